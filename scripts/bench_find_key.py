@@ -0,0 +1,145 @@
+"""
+Benchmark `find_key` against the previous recursive implementation,
+and `find_keys` against one `find_key` call per key.
+
+Uses GraphQL responses recorded by `Scraper(save=True)` if any are found in the given archive
+(default `data/raw`), otherwise synthetic timeline payloads of a similar shape.
+
+    python scripts/bench_find_key.py [data_dir] [-n ROUNDS]
+"""
+import argparse
+import random
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from twitter.archive import iter_archive
+from twitter.util import find_key, find_keys
+
+# keys looked up on every page by `Scraper`, `Search` and `log`
+KEYS = ['rest_id', 'entries', 'entryId', 'instructions']
+
+
+def find_key_recursive(obj: any, key: str) -> list:
+    """Previous implementation, kept for reference"""
+
+    def helper(obj: any, key: str, L: list) -> list:
+        if not obj:
+            return L
+
+        if isinstance(obj, list):
+            for e in obj:
+                L.extend(helper(e, key, []))
+            return L
+
+        if isinstance(obj, dict) and obj.get(key):
+            L.append(obj[key])
+
+        if isinstance(obj, dict) and obj:
+            for k in obj:
+                L.extend(helper(obj[k], key, []))
+        return L
+
+    return helper(obj, key, [])
+
+
+def synthetic_user(i: int) -> dict:
+    return {
+        '__typename': 'User',
+        'id': f'VXNlcjo{i}',
+        'rest_id': str(10 ** 17 + i),
+        'is_blue_verified': bool(i % 2),
+        'legacy': {
+            'created_at': 'Tue Jun 02 20:12:29 +0000 2009',
+            'description': 'lorem ipsum ' * 5,
+            'entities': {'description': {'urls': []}, 'url': {'urls': [{'expanded_url': 'https://example.com', 'indices': [0, 23]}]}},
+            'followers_count': i * 7,
+            'friends_count': i * 3,
+            'name': f'user {i}',
+            'screen_name': f'user{i}',
+            'profile_image_url_https': f'https://pbs.twimg.com/profile_images/{i}/photo_normal.jpg',
+        },
+    }
+
+
+def synthetic_tweet(i: int) -> dict:
+    return {
+        '__typename': 'Tweet',
+        'rest_id': str(10 ** 18 + i),
+        'core': {'user_results': {'result': synthetic_user(i)}},
+        'views': {'count': str(i * 11), 'state': 'EnabledWithCount'},
+        'legacy': {
+            'created_at': 'Wed Oct 18 12:00:00 +0000 2023',
+            'full_text': 'hello world ' * 10,
+            'entities': {
+                'hashtags': [{'indices': [0, 5], 'text': 'tag'}],
+                'media': [{'id_str': str(i), 'media_url_https': f'https://pbs.twimg.com/media/{i}.jpg',
+                           'original_info': {'height': 1080, 'width': 1920, 'focus_rects': [{'x': 0, 'y': 0, 'w': 1920, 'h': 1075}]}}],
+                'urls': [], 'user_mentions': [],
+            },
+            'favorite_count': i, 'retweet_count': i // 2, 'reply_count': i // 3,
+            'user_id_str': str(10 ** 17 + i),
+        },
+    }
+
+
+def synthetic_timeline(n: int = 20) -> dict:
+    entries = [{
+        'entryId': f'tweet-{10 ** 18 + i}',
+        'sortIndex': str(10 ** 18 - i),
+        'content': {
+            'entryType': 'TimelineTimelineItem',
+            'itemContent': {'itemType': 'TimelineTweet', 'tweet_results': {'result': synthetic_tweet(i)}},
+        },
+    } for i in range(n)]
+    entries += [
+        {'entryId': 'cursor-top-1', 'content': {'entryType': 'TimelineTimelineCursor', 'value': 'top', 'cursorType': 'Top'}},
+        {'entryId': 'cursor-bottom-1', 'content': {'entryType': 'TimelineTimelineCursor', 'value': 'bottom', 'cursorType': 'Bottom'}},
+    ]
+    return {'data': {'user': {'result': {'__typename': 'User', 'timeline_v2': {'timeline': {'instructions': [
+        {'type': 'TimelineClearCache'},
+        {'type': 'TimelineAddEntries', 'entries': entries},
+    ]}}}}}}
+
+
+def load_payloads(path: Path, limit: int = 200) -> list:
+    payloads = []
+    for record in iter_archive(path):
+        payloads.append(record['data'])
+        if len(payloads) >= limit:
+            break
+    return payloads
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('path', nargs='?', default='data/raw')
+    parser.add_argument('-n', '--rounds', type=int, default=20)
+    args = parser.parse_args()
+
+    payloads = load_payloads(Path(args.path))
+    source = f'{len(payloads)} recorded payloads from {args.path}'
+    if not payloads:
+        random.seed(0)
+        payloads = [synthetic_timeline(random.randint(10, 40)) for _ in range(50)]
+        source = f'{len(payloads)} synthetic timeline payloads'
+    print(f'Benchmarking find_key on {source}, {args.rounds} rounds\n')
+
+    for key in KEYS:
+        assert all(find_key(p, key) == find_key_recursive(p, key) for p in payloads), key
+        old = timeit.timeit(lambda: [find_key_recursive(p, key) for p in payloads], number=args.rounds)
+        new = timeit.timeit(lambda: [find_key(p, key) for p in payloads], number=args.rounds)
+        print(f'{key:<14} recursive: {old * 1e3:8.2f} ms\titerative: {new * 1e3:8.2f} ms\tspeedup: {old / new:5.2f}x')
+
+    print()
+    for keys in [('rest_id', 'entries'), ('entries', 'content', 'entryId')]:
+        assert all(find_keys(p, keys) == {k: find_key(p, k) for k in keys} for p in payloads), keys
+        old = timeit.timeit(lambda: [[find_key(p, k) for k in keys] for p in payloads], number=args.rounds)
+        new = timeit.timeit(lambda: [find_keys(p, keys) for p in payloads], number=args.rounds)
+        print(f'{", ".join(keys):<28} find_key x{len(keys)}: {old * 1e3:8.2f} ms\tfind_keys: {new * 1e3:8.2f} ms\tspeedup: {old / new:5.2f}x')
+
+
+if __name__ == '__main__':
+    main()
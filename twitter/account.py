@@ -6,6 +6,7 @@ import mimetypes
 import platform
 from copy import deepcopy
 from datetime import datetime
+from functools import wraps
 from string import ascii_letters
 from uuid import uuid1, getnode
 
@@ -15,6 +16,7 @@ from tqdm.asyncio import tqdm_asyncio
 
 from .constants import *
 from .login import login
+from .metrics import Metrics
 from .util import *
 
 try:
@@ -40,6 +42,7 @@ class Account:
         self.gql_api = 'https://twitter.com/i/api/graphql'
         self.v1_api = 'https://api.twitter.com/1.1'
         self.v2_api = 'https://twitter.com/i/api/2'
+        self.metrics = kwargs.get('metrics') or Metrics()
         self.logger = self._init_logger(**kwargs)
         self.session = self._validate_session(email, username, password, session, **kwargs)
 
@@ -54,12 +57,14 @@ class Account:
             data = {'json': params}
         else:
             data = {'params': {k: orjson.dumps(v).decode() for k, v in params.items()}}
+        start = time.perf_counter()
         r = self.session.request(
             method=method,
             url=f'{self.gql_api}/{qid}/{op}',
             headers=get_headers(self.session),
             **data
         )
+        self.metrics.response(op, r, time.perf_counter() - start)
         if self.debug:
             log(self.logger, self.debug, r)
         return r.json()
@@ -67,7 +72,9 @@ class Account:
     def v1(self, path: str, params: dict) -> dict:
         headers = get_headers(self.session)
         headers['content-type'] = 'application/x-www-form-urlencoded'
+        start = time.perf_counter()
         r = self.session.post(f'{self.v1_api}/{path}', headers=headers, data=urlencode(params))
+        self.metrics.response(path, r, time.perf_counter() - start)
         if self.debug:
             log(self.logger, self.debug, r)
         return r.json()
@@ -833,3 +840,30 @@ class Account:
         """ Save cookies to file """
         cookies = self.session.cookies
         Path(f'{fname or cookies.get("username")}.cookies').write_bytes(orjson.dumps(dict(cookies)))
+
+
+class AsyncAccount:
+    """
+    Awaitable counterpart of `Account`
+
+    `Account` is built on a blocking client, so each call runs in a worker thread
+    and the caller's event loop is never blocked.
+
+    e.g.
+    account = AsyncAccount(cookies='twitter.cookies')
+    await asyncio.gather(account.like(123), account.retweet(456))
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.account = Account(*args, **kwargs)
+
+    def __getattr__(self, name: str):
+        attr = getattr(self.account, name)
+        if name.startswith('_') or not callable(attr):
+            return attr
+
+        @wraps(attr)
+        async def wrapper(*args, **kwargs):
+            return await asyncio.to_thread(attr, *args, **kwargs)
+
+        return wrapper
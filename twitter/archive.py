@@ -0,0 +1,341 @@
+import asyncio
+import gzip
+import io
+import os
+import re
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Generator
+
+import orjson
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+SEGMENT_SIZE = 64 * 1024 ** 2  # bytes, after compression
+DICT_SIZE = 112 * 1024  # bytes
+DICT_SAMPLE_SIZE = 4 * 1024 ** 2  # bytes of records kept per operation to train a dictionary on
+
+SUFFIXES = {None: '.jsonl', 'gzip': '.jsonl.gz', 'zstd': '.jsonl.zst'}
+
+
+def resolve_compression(compression: str | bool | None) -> str | None:
+    """
+    Resolve the compression mode, zstd is preferred and gzip is used as a fallback if `zstandard` is not installed
+
+    @param compression: True, 'zstd', 'gzip', or None/False for no compression
+    @return: 'zstd', 'gzip' or None
+    """
+    if not compression:
+        return
+    if compression not in {True, 'zstd', 'gzip'}:
+        raise ValueError(f'Unknown compression: {compression}')
+    if compression == 'gzip' or zstandard is None:
+        return 'gzip'
+    return 'zstd'
+
+
+class Segment:
+    """A single append-only segment file, optionally compressed"""
+
+    def __init__(self, path: Path, seq: int, compression: str = None, level: int = None, zdict=None):
+        self.path = path
+        self.seq = seq
+        self.compression = compression
+        self.level = level
+        self.zdict = zdict
+        self.raw = path.open('xb')  # never shared, raises FileExistsError if another writer took it
+        self.fp = None
+        self.pending = False  # data written since the last frame was ended
+        if compression == 'zstd':
+            cctx = zstandard.ZstdCompressor(level=level or 3, dict_data=zdict)
+            self.fp = cctx.stream_writer(self.raw, closefd=False)
+        elif compression is None:
+            self.fp = self.raw
+
+    @property
+    def size(self) -> int:
+        return self.raw.tell()
+
+    def write(self, data: bytes):
+        if self.fp is None:
+            # gzip members can't be reopened once ended, each flush starts a new one
+            self.fp = gzip.GzipFile(fileobj=self.raw, mode='wb', compresslevel=self.level or 6)
+        self.fp.write(data)
+        self.pending = True
+
+    def flush(self):
+        """
+        End the current zstd frame or gzip member, so everything written so far can be read back
+        while the segment is still open. Readers decode the concatenated frames/members as one stream.
+        """
+        if self.pending:
+            if self.compression == 'zstd':
+                self.fp.flush(zstandard.FLUSH_FRAME)
+            elif self.compression == 'gzip':
+                self.fp.close()  # writes the member trailer, leaves `raw` open
+                self.fp = None
+            self.pending = False
+        self.raw.flush()
+
+    def close(self):
+        if self.fp is not None and self.fp is not self.raw:
+            self.fp.close()
+        self.raw.close()
+
+
+class ArchiveWriter:
+    """
+    Write-behind archive of raw responses
+
+    Records are queued and appended by a background task to segmented JSONL files, one set per
+    operation: `{path}/{name}/{name}-{seq:06d}.jsonl[.zst|.gz]`. A segment is rotated once it reaches
+    `segment_size` bytes, and each run starts a new segment. Segments are created exclusively, so several
+    writers can share a root without ever appending to the same segment.
+
+    Each line is `{"time": ns, "query": {...}, "data": <raw response>}`, the raw bytes are spliced
+    in as-is, they are never decoded.
+
+    With zstd compression, a dictionary is trained per operation on its first `DICT_SAMPLE_SIZE` bytes
+    of records (or whatever was written by close) and saved as `{path}/{name}/{name}.dict`. The segment is
+    rotated as soon as a dictionary is trained, all later segments (including those of later runs) are
+    compressed with it, which pays off for small, repetitive payloads.
+    """
+
+    def __init__(self, path: str | Path, segment_size: int = SEGMENT_SIZE, maxsize: int = 1024,
+                 compression: str | bool = None, level: int = None):
+        """
+        @param path: archive root
+        @param segment_size: max size of a segment in bytes
+        @param maxsize: max number of queued records, writers wait when the queue is full
+        @param compression: True or 'zstd' (falls back to gzip if `zstandard` is not installed), 'gzip', or None
+        @param level: compression level
+        """
+        self.path = Path(path)
+        self.segment_size = segment_size
+        self.maxsize = maxsize
+        self.compression = resolve_compression(compression)
+        self.level = level
+        self.files = {}  # name -> Segment
+        self.dicts = {}  # name -> zstandard.ZstdCompressionDict | None
+        self.samples = {}  # name -> list of records to train a dictionary on
+        self.sample_size = {}  # name -> total size of samples in bytes
+        self._queue = None
+        self._task = None
+        self._loop = None
+        # segments are written from worker threads, `flush` may run while the worker appends a batch
+        self._lock = threading.Lock()
+
+    async def write(self, name: str, content: bytes, query: dict = None):
+        """
+        Queue a raw response
+
+        @param name: operation name
+        @param content: raw response bytes (JSON)
+        @param query: query variables, stored alongside the response
+        """
+        if b'\n' in content:
+            # pretty-printed responses would break the one-record-per-line format
+            content = orjson.dumps(orjson.loads(content))
+        line = b''.join((
+            b'{"time":', str(time.time_ns()).encode(),
+            b',"query":', orjson.dumps(query or {}, option=orjson.OPT_NON_STR_KEYS),
+            b',"data":', content, b'}\n',
+        ))
+        await self._start().put((name, line))
+
+    async def flush(self):
+        """Wait until all queued records are written"""
+        if self._queue is not None and self._loop is asyncio.get_running_loop():
+            await self._queue.join()
+            await asyncio.to_thread(self._flush)
+
+    async def stop(self):
+        """
+        Flush queued records and stop the background task, segments are kept open
+
+        The task is started again by the next `write`, possibly on another event loop.
+        """
+        await self.flush()
+        if self._task is not None and self._loop is asyncio.get_running_loop():
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        self._queue = self._task = self._loop = None
+
+    async def aclose(self):
+        """Flush queued records, stop the background task and close all segments"""
+        await self.stop()
+        self.close()
+
+    def close(self):
+        with self._lock:
+            for seg in self.files.values():
+                seg.close()
+            for name in list(self.samples):
+                self._train(name)
+            self.files.clear()
+
+    def _start(self) -> asyncio.Queue:
+        # the queue and writer task are bound to the loop they were created on
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._task is None or self._task.done():
+            self._queue = asyncio.Queue(self.maxsize)
+            self._task = loop.create_task(self._worker(self._queue))
+            self._loop = loop
+        return self._queue
+
+    async def _worker(self, queue: asyncio.Queue):
+        while True:
+            batch = [await queue.get()]
+            # drain whatever else is ready, so each segment gets a single write per batch
+            while not queue.empty() and len(batch) < self.maxsize:
+                batch.append(queue.get_nowait())
+            try:
+                await asyncio.to_thread(self._append, batch)
+            except Exception as e:
+                print(f'Failed to archive {len(batch)} responses\n{e}')
+            finally:
+                for _ in batch:
+                    queue.task_done()
+
+    def _append(self, batch: list[tuple[str, bytes]]):
+        with self._lock:
+            for name, line in batch:
+                seg = self._segment(name)
+                seg.write(line)
+                if self.compression == 'zstd' and self.dicts.get(name) is None:
+                    self.samples.setdefault(name, []).append(line)
+                    self.sample_size[name] = self.sample_size.get(name, 0) + len(line)
+                    if self.sample_size[name] >= DICT_SAMPLE_SIZE:
+                        self._train(name)  # the next write rotates to a segment compressed with it
+
+    def _segment(self, name: str) -> Segment:
+        seg = self.files.get(name)
+        if seg is not None and seg.size < self.segment_size and seg.zdict is self._dict(name):
+            return seg
+        seq = seg.seq if seg is not None else self._last_seq(name)
+        if seg is not None:
+            seg.close()
+        out = self.path / name
+        out.mkdir(parents=True, exist_ok=True)
+        while True:
+            seq += 1
+            try:
+                seg = Segment(out / f'{name}-{seq:06d}{SUFFIXES[self.compression]}', seq,
+                              self.compression, self.level, self._dict(name))
+                break
+            except FileExistsError:
+                # another writer on the same root created it, move past everything it has created so far
+                seq = max(seq, self._last_seq(name))
+        self.files[name] = seg
+        return seg
+
+    def _dict(self, name: str):
+        if self.compression != 'zstd':
+            return
+        if name not in self.dicts:
+            p = self.path / name / f'{name}.dict'
+            self.dicts[name] = zstandard.ZstdCompressionDict(p.read_bytes()) if p.exists() else None
+        return self.dicts[name]
+
+    def _train(self, name: str):
+        """Train a dictionary on the sampled records of an operation, samples are dropped either way"""
+        samples = self.samples.pop(name, None)
+        self.sample_size.pop(name, None)
+        if self.compression != 'zstd' or self.dicts.get(name) is not None or not samples:
+            return
+        p = self.path / name / f'{name}.dict'
+        if not p.exists():
+            try:
+                zdict = zstandard.train_dictionary(DICT_SIZE, samples)
+            except zstandard.ZstdError:
+                return  # too few samples, sampling starts over
+            # published with a hard link, so it never replaces the dictionary of another writer on the same root
+            fd, tmp = tempfile.mkstemp(dir=p.parent, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as fp:
+                    fp.write(zdict.as_bytes())
+                os.link(tmp, p)
+                self.dicts[name] = zdict
+                return
+            except FileExistsError:
+                ...
+            finally:
+                os.unlink(tmp)
+        # another writer trained one first, segments must all be readable with the single `{name}.dict`
+        self.dicts[name] = zstandard.ZstdCompressionDict(p.read_bytes())
+
+    def _last_seq(self, name: str) -> int:
+        pattern = re.compile(rf'{re.escape(name)}-(\d+)\.jsonl(\.zst|\.gz)?')
+        seqs = [int(m.group(1)) for p in (self.path / name).glob(f'{name}-*.jsonl*') if (m := pattern.fullmatch(p.name))]
+        return max(seqs, default=0)
+
+    def _flush(self):
+        with self._lock:
+            for seg in self.files.values():
+                seg.flush()
+
+
+def open_segment(path: str | Path) -> io.BufferedIOBase:
+    """
+    Open a segment for streaming reads, decompressing on the fly
+
+    Zstd segments compressed with a dictionary are read with `{name}.dict` from the same directory.
+
+    @param path: path to a `.jsonl`, `.jsonl.gz` or `.jsonl.zst` segment
+    @return: binary file object, iterate it for one record (line) at a time
+    """
+    path = Path(path)
+    if path.suffix == '.gz':
+        return gzip.open(path, 'rb')
+    if path.suffix == '.zst':
+        if zstandard is None:
+            raise ImportError('zstandard is required to read .zst segments: pip install zstandard')
+        fp = path.open('rb')
+        if not (header := fp.read(18)):
+            return fp  # empty segment
+        zdict = None
+        if dict_id := zstandard.get_frame_parameters(header).dict_id:
+            p = path.parent / f'{path.name.rsplit("-", 1)[0]}.dict'
+            if not p.exists() or (zdict := zstandard.ZstdCompressionDict(p.read_bytes())).dict_id() != dict_id:
+                fp.close()
+                raise FileNotFoundError(f'Dictionary {dict_id} required to read {path} not found')
+        fp.seek(0)
+        reader = zstandard.ZstdDecompressor(dict_data=zdict).stream_reader(fp, read_across_frames=True, closefd=True)
+        return io.BufferedReader(reader)
+    return path.open('rb')
+
+
+def segments(path: str | Path, name: str = None) -> list[Path]:
+    """
+    Segments of an archive in write order
+
+    @param path: archive root
+    @param name: optional operation name, defaults to all operations
+    @return: list of segment paths
+    """
+    pattern = re.compile(r'(.+)-(\d+)\.jsonl(\.zst|\.gz)?')
+    found = []
+    for p in Path(path).glob(f'{name or "*"}/*.jsonl*'):
+        if (m := pattern.fullmatch(p.name)) and m.group(1) == p.parent.name:
+            found.append((m.group(1), int(m.group(2)), p))
+    return [p for *_, p in sorted(found)]
+
+
+def iter_archive(path: str | Path, name: str = None, raw: bool = False) -> Generator[dict | bytes, None, None]:
+    """
+    Stream records back from an archive, without unpacking it to disk
+
+    @param path: archive root, e.g. `data/raw`
+    @param name: optional operation name, defaults to all operations
+    @param raw: yield raw lines (bytes) instead of parsed records
+    @return: generator of records `{"time": ns, "query": {...}, "data": {...}}`
+    """
+    for p in segments(path, name):
+        with open_segment(p) as fp:
+            for line in fp:
+                yield line if raw else orjson.loads(line)
@@ -0,0 +1,66 @@
+from functools import cache
+
+from .constants import MAX_GQL_URL_LENGTH
+from .util import encode_qs
+
+# factor applied to the size of a request rejected with a 431, to get the new ceiling
+SHRINK = 0.9
+
+
+@cache
+def _char_len(c: str) -> int:
+    return len(encode_qs(c))
+
+
+def encoded_len(s: str) -> int:
+    """Length of `s` once encoded as a query string value (percent-encoding is per character, so lengths add up)"""
+    return sum(map(_char_len, s))
+
+
+class Batcher:
+    """
+    Pack ids into batch requests (`UsersByRestIds`, `TweetResultsByRestIds`) as large as the server accepts
+
+    Batches are sized on the full encoded request URL, including `features` and the other variables, not just the ids.
+    The ceiling per operation starts at `limit` and is lowered whenever a request is rejected with a 431.
+    """
+
+    def __init__(self, limit: int = MAX_GQL_URL_LENGTH):
+        """
+        @param limit: initial max length of a request URL
+        """
+        self.default = limit
+        self.limits = {}
+
+    def limit(self, name: str) -> int:
+        return self.limits.get(name, self.default)
+
+    def reject(self, name: str, size: int):
+        """
+        Lower the ceiling of an operation after a 431
+
+        @param name: operation name
+        @param size: length of the rejected request URL
+        """
+        self.limits[name] = min(self.limit(name), int(size * SHRINK))
+
+    def batch(self, name: str, ids: list, base: int) -> list[list[str]]:
+        """
+        @param name: operation name
+        @param ids: ids to batch
+        @param base: length of the request URL with an empty list of ids
+        @return: list of batches
+        """
+        budget = self.limit(name) - base
+        sep = encoded_len(',')
+        res, batch, size = [], [], 0
+        for x in map(str, ids):
+            n = encoded_len(f'"{x}"')
+            if batch and size + sep + n > budget:
+                res.append(batch)
+                batch, size = [], 0
+            size += n + sep if batch else n
+            batch.append(x)
+        if batch:
+            res.append(batch)
+        return res
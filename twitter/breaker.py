@@ -0,0 +1,120 @@
+import time
+from collections import deque
+
+from .constants import RATE_LIMIT_WINDOW
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half-open'
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of sending a request when the circuit of an operation is open for every session"""
+
+
+def failed(r) -> bool:
+    """
+    Whether a response counts against the health of an endpoint
+
+    Server errors, and the client errors returned for a stale `queryId`. Rate limits (429), oversized
+    requests (431) and unauthorized sessions (401) are handled elsewhere and do not count.
+    """
+    return r.status_code >= 500 or r.status_code in {400, 403, 404}
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker of a single (operation, session)
+
+    - closed: requests flow, the outcome of the last `window` requests is tracked
+    - open: the error rate reached `threshold`, requests fail fast for `cooldown` seconds
+    - half-open: after the cooldown, a single probe request is let through. success closes the
+      circuit, failure opens it again with twice the cooldown (up to `max_cooldown`)
+    """
+
+    def __init__(self, threshold: float = 0.5, window: int = 20, min_requests: int = 10, cooldown: float = 30,
+                 max_cooldown: float = RATE_LIMIT_WINDOW):
+        """
+        @param threshold: error rate at which the circuit opens
+        @param window: number of recent requests the error rate is computed on
+        @param min_requests: min number of requests in the window before the circuit can open
+        @param cooldown: seconds the circuit stays open before a probe
+        @param max_cooldown: max cooldown in seconds, after repeated failed probes
+        """
+        self.threshold = threshold
+        self.min_requests = min_requests
+        self.base_cooldown = self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.results = deque(maxlen=window)
+        self.state = CLOSED
+        self.opened = None
+        self.probing = False
+        self.trips = 0
+
+    @property
+    def error_rate(self) -> float:
+        return self.results.count(False) / len(self.results) if self.results else 0.0
+
+    def ready(self) -> bool:
+        """Whether a request can be sent now (does not claim the half-open probe, see `allow`)"""
+        if self.state == OPEN and time.time() - self.opened >= self.cooldown:
+            self.state = HALF_OPEN
+            self.probing = False
+        if self.state == HALF_OPEN:
+            return not self.probing
+        return self.state == CLOSED
+
+    def allow(self) -> bool:
+        """Claim permission to send a request"""
+        if not self.ready():
+            return False
+        if self.state == HALF_OPEN:
+            self.probing = True
+        return True
+
+    def tripped(self) -> bool:
+        """Whether the circuit is open (failing fast, not yet due for a probe)"""
+        self.ready()
+        return self.state == OPEN
+
+    def cancel(self):
+        """Release a request sent with `allow` whose outcome says nothing about the endpoint, e.g. a 429"""
+        self.probing = False
+
+    def record(self, ok: bool):
+        """Record the outcome of a request sent with `allow`"""
+        if self.state == OPEN:
+            return  # requests sent before the circuit opened
+        if self.state == HALF_OPEN:
+            self.probing = False
+            if ok:
+                self.state = CLOSED
+                self.cooldown = self.base_cooldown
+                self.results.clear()
+            else:
+                self._open(min(self.cooldown * 2, self.max_cooldown))
+            return
+        self.results.append(ok)
+        if len(self.results) >= self.min_requests and self.error_rate >= self.threshold:
+            self._open(self.cooldown)
+
+    def retry_in(self) -> float:
+        """Seconds until the next probe, 0 if not open"""
+        if self.state != OPEN:
+            return 0
+        return max(self.opened + self.cooldown - time.time(), 0)
+
+    def status(self) -> dict:
+        self.ready()
+        return {
+            'state': self.state,
+            'error_rate': round(self.error_rate, 3),
+            'requests': len(self.results),
+            'trips': self.trips,
+            'retry_in': round(self.retry_in(), 1),
+        }
+
+    def _open(self, cooldown: float):
+        self.state = OPEN
+        self.opened = time.time()
+        self.cooldown = cooldown
+        self.trips += 1
+        self.results.clear()
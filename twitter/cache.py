@@ -0,0 +1,117 @@
+import sqlite3
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+import orjson
+
+from .util import Page
+
+# seconds, per operation. operations not listed here are never cached
+DEFAULT_TTL = {
+    'UserByScreenName': 60 * 60,
+    'UserByRestId': 60 * 60,
+    'UsersByRestIds': 60 * 60,
+    'TweetResultByRestId': 10 * 60,
+    'TweetResultsByRestIds': 10 * 60,
+}
+
+# `content` is stored decoded, these no longer apply
+SKIP_HEADERS = {'content-encoding', 'content-length', 'transfer-encoding'}
+
+
+class ResponseCache:
+    """
+    TTL cache of GraphQL responses (pages), keyed by (operation, variables)
+
+    Entries live in an in-memory LRU of at most `maxsize` responses, and optionally in an
+    on-disk (SQLite) tier that survives restarts.
+    """
+
+    def __init__(self, ttl: dict = None, maxsize: int = 10_000, path: str | Path = None):
+        """
+        @param ttl: TTL in seconds per operation name, merged with `DEFAULT_TTL`. use 0 to disable caching of an operation
+        @param maxsize: max number of responses kept in memory
+        @param path: optional path of the on-disk tier
+        """
+        self.ttl = DEFAULT_TTL | (ttl or {})
+        self.maxsize = maxsize
+        self.mem = OrderedDict()
+        self.db = None
+        self.hits = self.misses = 0
+        if path:
+            path = Path(path)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self.db = sqlite3.connect(path, isolation_level=None)
+            self.db.execute('PRAGMA journal_mode=WAL')
+            self.db.execute('''
+                CREATE TABLE IF NOT EXISTS cache (
+                    key TEXT PRIMARY KEY,
+                    expires REAL NOT NULL,
+                    status INTEGER NOT NULL,
+                    url TEXT NOT NULL,
+                    headers BLOB NOT NULL,
+                    content BLOB NOT NULL
+                )
+            ''')
+            self.db.execute('DELETE FROM cache WHERE expires < ?', (time.time(),))
+
+    @staticmethod
+    def key(name: str, variables: dict) -> str:
+        return f'{name}:{orjson.dumps(variables, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS).decode()}'
+
+    def cacheable(self, name: str) -> bool:
+        return self.ttl.get(name, 0) > 0
+
+    def get(self, name: str, variables: dict) -> Page | None:
+        """Get a cached page. Each hit is a copy with its own parsed tree, callers may mutate results"""
+        if not self.cacheable(name):
+            return
+        key = self.key(name, variables)
+        now = time.time()
+        if entry := self.mem.get(key):
+            expires, r = entry
+            if expires > now:
+                self.mem.move_to_end(key)
+                self.hits += 1
+                return r.copy()
+            del self.mem[key]
+        if self.db and (row := self.db.execute('SELECT expires, status, url, headers, content FROM cache WHERE key = ?', (key,)).fetchone()):
+            expires, status, url, headers, content = row
+            if expires > now:
+                r = Page(content, status, orjson.loads(headers), url)
+                self._remember(key, expires, r)
+                self.hits += 1
+                return r.copy()
+        self.misses += 1
+
+    def set(self, name: str, variables: dict, r: Page):
+        if not self.cacheable(name) or r.status_code != 200:
+            return
+        try:
+            if r.data.get('errors'):
+                return
+        except Exception:
+            return
+        key = self.key(name, variables)
+        expires = time.time() + self.ttl[name]
+        self._remember(key, expires, r)
+        if self.db:
+            self.db.execute('INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?, ?, ?)', (
+                key, expires, r.status_code, str(r.url), orjson.dumps([(k, v) for k, v in r.headers.multi_items() if k not in SKIP_HEADERS]), r.content
+            ))
+
+    def _remember(self, key: str, expires: float, r: Page):
+        self.mem[key] = (expires, r)
+        self.mem.move_to_end(key)
+        while len(self.mem) > self.maxsize:
+            self.mem.popitem(last=False)
+
+    def clear(self):
+        self.mem.clear()
+        if self.db:
+            self.db.execute('DELETE FROM cache')
+
+    def close(self):
+        if self.db:
+            self.db.close()
@@ -0,0 +1,75 @@
+import sqlite3
+import time
+from pathlib import Path
+
+import orjson
+
+# pagination controls, not part of the query identity
+IGNORED_KEYS = {'cursor', 'limit', 'max_query'}
+
+
+class CheckpointStore:
+    """
+    SQLite-backed pagination state
+
+    Records (operation, query, cursor, page count) after every page, so interrupted crawls can
+    resume from the last committed cursor instead of starting over.
+    """
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(self.path, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('''
+            CREATE TABLE IF NOT EXISTS checkpoints (
+                operation TEXT NOT NULL,
+                query TEXT NOT NULL,
+                cursor TEXT,
+                pages INTEGER NOT NULL DEFAULT 0,
+                done INTEGER NOT NULL DEFAULT 0,
+                updated REAL NOT NULL,
+                PRIMARY KEY (operation, query)
+            )
+        ''')
+
+    @staticmethod
+    def key(query: dict) -> str:
+        return orjson.dumps({k: v for k, v in query.items() if k not in IGNORED_KEYS},
+                            option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS).decode()
+
+    def get(self, operation: str, query: dict) -> dict | None:
+        """
+        Get the last committed state of a query
+
+        @param operation: operation name
+        @param query: query variables
+        @return: dict with `cursor`, `pages` and `done`, or None if the query was never checkpointed
+        """
+        row = self.db.execute('SELECT cursor, pages, done FROM checkpoints WHERE operation = ? AND query = ?',
+                              (operation, self.key(query))).fetchone()
+        if row:
+            cursor, pages, done = row
+            return {'cursor': cursor, 'pages': pages, 'done': bool(done)}
+
+    def commit(self, operation: str, query: dict, cursor: str | None, pages: int, done: bool = False):
+        self.db.execute('''
+            INSERT INTO checkpoints (operation, query, cursor, pages, done, updated) VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (operation, query) DO UPDATE SET
+                cursor = excluded.cursor, pages = excluded.pages, done = excluded.done, updated = excluded.updated
+        ''', (operation, self.key(query), cursor, pages, int(done), time.time()))
+
+    def clear(self, operation: str = None, query: dict = None):
+        """Forget checkpoints, optionally only for a specific operation and/or query"""
+        sql, args = 'DELETE FROM checkpoints WHERE 1', []
+        if operation:
+            sql += ' AND operation = ?'
+            args.append(operation)
+        if query:
+            sql += ' AND query = ?'
+            args.append(self.key(query))
+        self.db.execute(sql, args)
+
+    def close(self):
+        self.db.close()
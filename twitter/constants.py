@@ -1,9 +1,9 @@
 from dataclasses import dataclass
 
-# todo: not accurate measure. value will decrease as new gql features/variables are required. (actual limitation is request size, i.e. new gql features an variables contribute to total request size)
-MAX_GQL_CHAR_LIMIT = 4_200
+MAX_GQL_URL_LENGTH = 9_500  # full encoded request URL of batch queries, larger requests are rejected with a 431
 
 MAX_ENDPOINT_LIMIT = 500  # 500/15 mins
+RATE_LIMIT_WINDOW = 15 * 60  # seconds
 
 MAX_IMAGE_SIZE = 5_242_880  # ~5 MB
 MAX_GIF_SIZE = 15_728_640  # ~15 MB
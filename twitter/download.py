@@ -0,0 +1,535 @@
+import asyncio
+import hashlib
+import os
+import re
+import time
+from pathlib import Path
+from typing import AsyncIterable, Iterable
+from urllib.parse import urlsplit
+
+import aiofiles
+import m3u8
+import orjson
+from httpx import AsyncClient
+from tqdm import tqdm
+
+PART = '.part'
+VALIDATOR = '.validator'
+RANGES = '.ranges'
+SEGMENT_SIZE = 4 * 1024 * 1024  # bytes per ranged request
+
+
+def part_path(fname: Path) -> Path:
+    return fname.with_name(fname.name + PART)
+
+
+def validator_path(fname: Path) -> Path:
+    return fname.with_name(fname.name + PART + VALIDATOR)
+
+
+def ranges_path(fname: Path) -> Path:
+    return fname.with_name(fname.name + PART + RANGES)
+
+
+def audio_path(fname: Path) -> Path:
+    """Where the separate audio rendition of an HLS video is saved"""
+    return fname.with_name(f'{fname.stem}_audio{fname.suffix}')
+
+
+def output_name(url: str) -> str:
+    """
+    File name of a downloaded url, the last path component
+
+    HLS playlists (`.m3u8`) are saved as the media they point to, `.mp4` for fragmented mp4, `.ts` otherwise.
+    """
+    _, _, path, query, _ = urlsplit(url)
+    name = path.split('/')[-1]
+    if name.endswith('.m3u8'):
+        return f'{name[:-5]}{".mp4" if "fmp4" in query else ".ts"}'
+    return name
+
+
+def content_range_start(r) -> int | None:
+    """First byte position of a 206 response, from `content-range: bytes {start}-{end}/{total}`"""
+    if m := re.match(r'bytes (\d+)-', r.headers.get('content-range', '')):
+        return int(m.group(1))
+
+
+def content_range_total(r) -> int | None:
+    """Full size of the resource, from `content-range: bytes {start}-{end}/{total}`"""
+    if m := re.match(r'bytes [\d*-]+/(\d+)', r.headers.get('content-range', '')):
+        return int(m.group(1))
+
+
+def content_length(r) -> int | None:
+    try:
+        return int(r.headers['content-length'])
+    except (KeyError, ValueError):
+        return None
+
+
+async def is_complete(client: AsyncClient, url: str, fname: Path, verify: bool = False) -> bool:
+    """
+    Whether `fname` is already downloaded
+
+    Files are only ever renamed into place once complete, so existence is enough. With `verify`, the size is
+    also checked against the `content-length` of a HEAD request (for files written by other tools). HLS streams are
+    assembled from many segments and have no size to compare against, so they are never verified.
+    """
+    if not fname.exists():
+        return False
+    if not verify or urlsplit(url).path.endswith('.m3u8'):
+        return True
+    r = await client.head(url)
+    return r.status_code != 200 or content_length(r) in {None, fname.stat().st_size}
+
+
+async def download(client: AsyncClient, url: str, fname: Path, chunk_size: int = None, verify: bool = False,
+                   throttle: 'Throttle' = None, connections: int = 1) -> int:
+    """
+    Download `url` to `fname`, skipping complete files and resuming partial ones
+
+    Data is written to `{fname}.part` and atomically renamed to `fname` once complete. An interrupted download is
+    resumed with a `Range` request, guarded by `If-Range` with the `ETag` (or `Last-Modified`) of the original
+    response so a changed file is downloaded again from scratch.
+
+    @param client: client to download with
+    @param url: url to download
+    @param fname: destination path
+    @param chunk_size: size of chunks written to disk
+    @param verify: check the size of existing files against the server
+    @param throttle: optional bandwidth limit, shared between downloads
+    @param connections: split files larger than `SEGMENT_SIZE` into ranges fetched over this many connections,
+        see `download_ranges`. HLS playlists are always fetched segment by segment, see `download_hls`
+    @return: number of bytes transferred
+    """
+    if await is_complete(client, url, fname, verify):
+        return 0
+    if urlsplit(url).path.endswith('.m3u8'):
+        return await download_hls(client, url, fname, connections, throttle)
+    if hasattr(os, 'pwrite') and (connections > 1 or ranges_path(fname).exists()):
+        return await download_ranges(client, url, fname, connections, chunk_size, throttle)
+    part, validator = part_path(fname), validator_path(fname)
+    offset = part.stat().st_size if part.exists() else 0
+    headers = {}
+    if offset:
+        headers['range'] = f'bytes={offset}-'
+        if validator.exists():
+            headers['if-range'] = validator.read_text()
+
+    transferred = 0
+    async with client.stream('GET', url, headers=headers) as r:
+        if r.status_code == 416:
+            if re.match(rf'bytes \*/{offset}$', r.headers.get('content-range', '')):
+                # nothing left to fetch, the previous run was interrupted before the rename
+                os.replace(part, fname)
+                validator.unlink(missing_ok=True)
+                return 0
+            # larger than the file on the server, discard it
+            part.unlink()
+            validator.unlink(missing_ok=True)
+            return await download(client, url, fname, chunk_size, throttle=throttle)
+        r.raise_for_status()
+        if r.status_code != 206 or content_range_start(r) != offset:
+            # range not honored, or the file changed (`If-Range` mismatch): start over
+            offset = 0
+            if tag := r.headers.get('etag') or r.headers.get('last-modified'):
+                validator.write_text(tag)
+            else:
+                validator.unlink(missing_ok=True)
+        async with aiofiles.open(part, 'ab' if offset else 'wb') as fp:
+            async for chunk in r.aiter_raw(chunk_size):
+                await fp.write(chunk)
+                transferred += len(chunk)
+                if throttle:
+                    await throttle.consume(len(chunk))
+    os.replace(part, fname)
+    validator.unlink(missing_ok=True)
+    return transferred
+
+
+class RemoteChanged(Exception):
+    """The file changed on the server during a segmented download"""
+
+
+async def write_at(fd: int, r, offset: int, chunk_size: int = None, throttle: 'Throttle' = None) -> int:
+    """Write a streamed response body to `fd` at `offset`, return the number of bytes written"""
+    n = 0
+    async for chunk in r.aiter_raw(chunk_size):
+        await asyncio.to_thread(os.pwrite, fd, chunk, offset + n)
+        n += len(chunk)
+        if throttle:
+            await throttle.consume(len(chunk))
+    return n
+
+
+def preallocate(fd: int, size: int):
+    try:
+        os.posix_fallocate(fd, 0, size)
+    except (AttributeError, OSError):
+        # not supported by the platform or filesystem, a sparse file will do
+        os.ftruncate(fd, size)
+
+
+async def download_ranges(client: AsyncClient, url: str, fname: Path, connections: int = 4, chunk_size: int = None,
+                          throttle: 'Throttle' = None) -> int:
+    """
+    Download a large file as `SEGMENT_SIZE` byte ranges over several connections
+
+    The first request asks for the first range only, which is the whole file when it is small (or when the server
+    ignores ranges), so small files take a single request. Larger files are preallocated as `{fname}.part` and the
+    remaining ranges fetched in parallel and written in place with `pwrite`. Completed ranges are recorded in
+    `{fname}.part.ranges`, so an interrupted download only fetches the missing ones.
+
+    @param client: client to download with
+    @param url: url to download
+    @param fname: destination path
+    @param connections: max number of ranges fetched at once
+    @param chunk_size: size of chunks written to disk
+    @param throttle: optional bandwidth limit, shared between downloads
+    @return: number of bytes transferred
+    """
+    part, ranges = part_path(fname), ranges_path(fname)
+    state = orjson.loads(ranges.read_bytes()) if ranges.exists() and part.exists() else None
+    transferred = 0
+    if state is None:
+        async with client.stream('GET', url, headers={'range': f'bytes=0-{SEGMENT_SIZE - 1}'}) as r:
+            r.raise_for_status()
+            size = content_range_total(r)
+            if r.status_code != 206 or size is None or size <= SEGMENT_SIZE:
+                # small file, or ranges not supported: this is the whole file
+                async with aiofiles.open(part, 'wb') as fp:
+                    async for chunk in r.aiter_raw(chunk_size):
+                        await fp.write(chunk)
+                        transferred += len(chunk)
+                        if throttle:
+                            await throttle.consume(len(chunk))
+                ranges.unlink(missing_ok=True)
+                os.replace(part, fname)
+                return transferred
+            state = {'size': size, 'validator': r.headers.get('etag') or r.headers.get('last-modified'), 'done': []}
+            fd = os.open(part, os.O_RDWR | os.O_CREAT | os.O_TRUNC)
+            try:
+                preallocate(fd, size)
+                transferred += await write_at(fd, r, 0, chunk_size, throttle)
+            finally:
+                os.close(fd)
+        state['done'].append(0)
+        ranges.write_bytes(orjson.dumps(state))
+
+    size, validator, done = state['size'], state['validator'], set(state['done'])
+    pending = iter([i for i in range(-(-size // SEGMENT_SIZE)) if i not in done])
+
+    async def get(i: int) -> int:
+        start = i * SEGMENT_SIZE
+        end = min(start + SEGMENT_SIZE, size) - 1
+        headers = {'range': f'bytes={start}-{end}'}
+        if validator:
+            headers['if-range'] = validator
+        async with client.stream('GET', url, headers=headers) as r:
+            r.raise_for_status()
+            if r.status_code != 206 or content_range_start(r) != start or content_range_total(r) != size:
+                raise RemoteChanged(url)
+            n = await write_at(fd, r, start, chunk_size, throttle)
+        if n != end - start + 1:
+            raise ValueError(f'Incomplete range {start}-{end} of {url}, got {n} bytes')
+        done.add(i)
+        tmp = ranges.with_name(ranges.name + '.tmp')
+        tmp.write_bytes(orjson.dumps(state | {'done': sorted(done)}))
+        tmp.replace(ranges)
+        return n
+
+    async def worker():
+        nonlocal transferred
+        for i in pending:
+            n = await get(i)
+            transferred += n
+
+    fd = os.open(part, os.O_RDWR)
+    tasks = [asyncio.ensure_future(worker()) for _ in range(connections)]
+    changed = False
+    try:
+        await asyncio.gather(*tasks)
+    except RemoteChanged:
+        changed = True
+    finally:
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        os.close(fd)
+    if changed:
+        part.unlink()
+        ranges.unlink()
+        return transferred + await download_ranges(client, url, fname, connections, chunk_size, throttle)
+    os.replace(part, fname)
+    ranges.unlink()
+    return transferred
+
+
+async def download_hls(client: AsyncClient, url: str, fname: Path, connections: int = 4, throttle: 'Throttle' = None) -> int:
+    """
+    Download an HLS stream segment by segment into a single file
+
+    A master playlist resolves to its highest bandwidth variant. If that variant has a separate audio rendition, it is
+    saved next to the video as `{stem}_audio{suffix}`. Up to `connections` segments are fetched ahead, and written in
+    order (after their `EXT-X-MAP` initialization section, for fragmented mp4) to `{fname}.part`, renamed when complete.
+
+    @param client: client to download with
+    @param url: playlist url
+    @param fname: destination path
+    @param connections: max number of segments fetched at once
+    @param throttle: optional bandwidth limit, shared between downloads
+    @return: number of bytes transferred
+    """
+    r = await client.get(url)
+    r.raise_for_status()
+    playlist = m3u8.loads(r.text, uri=url)
+    transferred = 0
+    if playlist.is_variant:
+        best = max(playlist.playlists, key=lambda p: p.stream_info.bandwidth or 0)
+        if group := best.stream_info.audio:
+            for media in playlist.media:
+                if media.type == 'AUDIO' and media.group_id == group and media.uri:
+                    audio = audio_path(fname)
+                    if not audio.exists():
+                        transferred += await download_hls(client, media.absolute_uri, audio, connections, throttle)
+                    break
+        return transferred + await download_hls(client, best.absolute_uri, fname, connections, throttle)
+    if any(k and k.method != 'NONE' for k in playlist.keys):
+        raise ValueError(f'Encrypted HLS streams are not supported: {url}')
+
+    # (url, byte range) of every resource, in playback order
+    parts, init, offsets = [], None, {}
+    for seg in playlist.segments:
+        if seg.init_section and seg.init_section.absolute_uri != init:
+            init = seg.init_section.absolute_uri
+            parts.append((init, None))
+        byterange = None
+        if seg.byterange:
+            length, _, offset = seg.byterange.partition('@')
+            start = int(offset) if offset else offsets.get(seg.absolute_uri, 0)
+            offsets[seg.absolute_uri] = start + int(length)
+            byterange = f'bytes={start}-{start + int(length) - 1}'
+        parts.append((seg.absolute_uri, byterange))
+
+    async def get(uri: str, byterange: str | None) -> bytes:
+        r = await client.get(uri, headers={'range': byterange} if byterange else None)
+        r.raise_for_status()
+        if throttle:
+            await throttle.consume(len(r.content))
+        return r.content
+
+    part = part_path(fname)
+    window = []
+    it = iter(parts)
+    try:
+        async with aiofiles.open(part, 'wb') as fp:
+            while True:
+                # keep `connections` segments in flight, write them in order
+                while len(window) < connections and (nxt := next(it, None)):
+                    window.append(asyncio.ensure_future(get(*nxt)))
+                if not window:
+                    break
+                data = await window.pop(0)
+                await fp.write(data)
+                transferred += len(data)
+    finally:
+        for t in window:
+            t.cancel()
+        await asyncio.gather(*window, return_exceptions=True)
+    os.replace(part, fname)
+    return transferred
+
+
+class MediaStore:
+    """
+    Content-addressed media store
+
+    Media is keyed by its CDN url (host, path and variant, e.g. `?name=orig`) and downloaded once to
+    `{path}/.blobs/{key[:2]}/{key}{ext}`. Every tweet then gets a hardlink to the shared blob, or, where hardlinks are
+    not supported (e.g. across filesystems), an entry in `{path}/manifest.jsonl` mapping the file name to the blob.
+    """
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        self.blobs = self.path / '.blobs'
+        self.manifest = self.path / 'manifest.jsonl'
+        self.links = {}
+        if self.manifest.exists():
+            with self.manifest.open('rb') as fp:
+                self.links = {(x := orjson.loads(line))['file']: x['blob'] for line in fp if line.strip()}
+        self._inflight = {}
+
+    @staticmethod
+    def key(url: str) -> str:
+        _, netloc, path, query, _ = urlsplit(url)
+        return hashlib.sha256(f'{netloc}{path}?{query}'.encode()).hexdigest()
+
+    def blob(self, url: str) -> Path:
+        k = self.key(url)
+        return self.blobs / k[:2] / f'{k}{Path(output_name(url)).suffix}'
+
+    def resolve(self, fname: str | Path) -> Path | None:
+        """Path holding the content of a per-tweet file, whether hardlinked or in the manifest"""
+        fname = Path(fname)
+        if fname.exists():
+            return fname
+        if blob := self.links.get(fname.name):
+            return self.path / blob
+
+    async def fetch(self, client: AsyncClient, url: str, fname: Path, chunk_size: int = None, verify: bool = False,
+                    throttle: 'Throttle' = None, connections: int = 1) -> int:
+        """
+        Download `url` into the store unless already present, and link it as `fname`
+
+        Concurrent requests for the same blob share a single download.
+
+        @return: number of bytes transferred
+        """
+        if fname.exists() or fname.name in self.links:
+            return 0
+        blob = self.blob(url)
+        if task := self._inflight.get(blob):
+            await asyncio.shield(task)
+            n = 0
+        else:
+            blob.parent.mkdir(parents=True, exist_ok=True)
+            task = self._inflight[blob] = asyncio.ensure_future(download(client, url, blob, chunk_size, verify, throttle, connections))
+            task.add_done_callback(lambda _: self._inflight.pop(blob, None))
+            n = await task
+        self.link(blob, fname)
+        if (audio := audio_path(blob)).exists():
+            self.link(audio, audio_path(fname))
+        return n
+
+    def link(self, blob: Path, fname: Path):
+        try:
+            os.link(blob, fname)
+        except FileExistsError:
+            ...
+        except OSError:
+            rel = blob.relative_to(self.path).as_posix()
+            self.links[fname.name] = rel
+            with self.manifest.open('ab') as fp:
+                fp.write(orjson.dumps({'file': fname.name, 'blob': rel}) + b'\n')
+
+
+class Throttle:
+    """
+    Token bucket limiting the combined bandwidth of all downloads
+
+    Consumers may overdraw the bucket, and then sleep until the debt is paid back, so a large chunk never blocks forever.
+    """
+
+    def __init__(self, rate: float, burst: float = None):
+        """
+        @param rate: bytes per second
+        @param burst: max bytes transferred at once after an idle period, defaults to one second worth
+        """
+        self.rate = rate
+        self.capacity = burst or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    async def consume(self, n: int):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate) - n
+        self.updated = now
+        if self.tokens < 0:
+            await asyncio.sleep(-self.tokens / self.rate)
+
+
+class Downloader:
+    """
+    Bounded producer/consumer download pipeline
+
+    A fixed number of workers pull `(url, fname)` items from a bounded queue, fed lazily from an iterable or async
+    iterable, so memory stays flat however many urls there are. Concurrent requests are also limited per host, and
+    the combined bandwidth can be capped.
+    """
+
+    def __init__(self, client: AsyncClient, workers: int = 32, per_host: int = 16, bandwidth: float = None,
+                 chunk_size: int = None, verify: bool = False, store: MediaStore = None, connections: int = 1,
+                 desc: str = None):
+        """
+        @param client: client to download with
+        @param workers: number of concurrent downloads
+        @param per_host: max concurrent downloads per host
+        @param bandwidth: max combined bytes per second, unlimited by default
+        @param chunk_size: size of chunks written to disk
+        @param verify: check the size of existing files against the server
+        @param store: optional content-addressed store, see `MediaStore`
+        @param connections: connections per file, for large files (see `download_ranges`) and HLS streams
+        @param desc: show a progress bar with this description
+        """
+        self.client = client
+        self.workers = workers
+        self.per_host = per_host
+        self.throttle = Throttle(bandwidth) if bandwidth else None
+        self.chunk_size = chunk_size
+        self.verify = verify
+        self.store = store
+        self.connections = connections
+        self.desc = desc
+        self.hosts = {}
+        self.stats = {'downloaded': 0, 'skipped': 0, 'failed': 0, 'bytes': 0}
+        self.failed = []
+
+    def host(self, url: str) -> asyncio.Semaphore:
+        netloc = urlsplit(url).netloc
+        if (sem := self.hosts.get(netloc)) is None:
+            sem = self.hosts[netloc] = asyncio.Semaphore(self.per_host)
+        return sem
+
+    async def get(self, url: str, fname: Path) -> int:
+        async with self.host(url):
+            if self.store:
+                return await self.store.fetch(self.client, url, fname, self.chunk_size, self.verify, self.throttle,
+                                              self.connections)
+            return await download(self.client, url, fname, self.chunk_size, self.verify, self.throttle, self.connections)
+
+    async def run(self, items: Iterable[tuple[str, Path]] | AsyncIterable[tuple[str, Path]], total: int = None) -> dict:
+        """
+        Download all items
+
+        Failed downloads do not stop the others, they are collected in `failed` as `(url, fname, exception)`.
+
+        @param items: `(url, fname)` pairs
+        @param total: number of items, for the progress bar
+        @return: stats, number of files downloaded, skipped and failed, and bytes transferred
+        """
+        queue = asyncio.Queue(maxsize=self.workers * 2)
+        done = object()
+        pbar = tqdm(total=total, desc=self.desc) if self.desc else None
+
+        async def produce():
+            try:
+                if isinstance(items, AsyncIterable):
+                    async for item in items:
+                        await queue.put(item)
+                else:
+                    for item in items:
+                        await queue.put(item)
+            finally:
+                for _ in range(self.workers):
+                    await queue.put(done)
+
+        async def worker():
+            while (item := await queue.get()) is not done:
+                url, fname = item
+                try:
+                    n = await self.get(url, fname)
+                    self.stats['downloaded' if n else 'skipped'] += 1
+                    self.stats['bytes'] += n
+                except Exception as e:
+                    self.stats['failed'] += 1
+                    self.failed.append((url, fname, e))
+                if pbar is not None:
+                    pbar.update()
+
+        try:
+            await asyncio.gather(produce(), *(worker() for _ in range(self.workers)))
+        finally:
+            if pbar is not None:
+                pbar.close()
+        return self.stats
@@ -0,0 +1,265 @@
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Iterable
+
+import orjson
+
+from .archive import iter_archive
+from .transform import build_tweet, build_user
+from .util import find_keys
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+BATCH_SIZE = 65_536  # rows
+MAX_OPEN_WRITERS = 64
+
+# partition granularity -> (hive key, date format)
+PARTITIONS = {
+    'day': ('date', '%Y-%m-%d'),
+    'month': ('month', '%Y-%m'),
+    'year': ('year', '%Y'),
+}
+
+# (column, type) of `transform.build_user` records
+USER_FIELDS = [
+    ('id', 'int64'),
+    ('id_str', 'string'),
+    ('created_at', 'timestamp'),
+    ('description', 'string'),
+    ('favourites_count', 'int64'),
+    ('followers_count', 'int64'),
+    ('friends_count', 'int64'),
+    ('listed_count', 'int64'),
+    ('media_count', 'int64'),
+    ('name', 'string'),
+    ('screen_name', 'string'),
+    ('statuses_count', 'int64'),
+]
+
+# (column, type) of `transform.build_tweet` records, `user` is flattened to `user_*` columns
+TWEET_FIELDS = [
+    ('id', 'int64'),
+    ('id_str', 'string'),
+    ('created_at', 'timestamp'),
+    ('text', 'string'),
+    ('lang', 'string'),
+    ('possibly_sensitive', 'bool'),
+    ('bookmark_count', 'int64'),
+    ('favorite_count', 'int64'),
+    ('quote_count', 'int64'),
+    ('reply_count', 'int64'),
+    ('retweet_count', 'int64'),
+    ('retweeted_status_id', 'int64'),
+    ('quoted_status_id', 'int64'),
+    ('hashtags', 'list<string>'),
+    ('urls', 'list<url>'),
+    ('media', 'json'),  # variable shape, stored as a JSON string
+    *((f'user_{k}', t) for k, t in USER_FIELDS),
+]
+
+
+def parse_date(s: str | None) -> datetime | None:
+    """Parse a Twitter date, e.g. `Wed Oct 18 12:00:00 +0000 2023`"""
+    if s:
+        return datetime.strptime(s, '%a %b %d %H:%M:%S %z %Y')
+
+
+def user_row(user: dict | None, prefix: str = '') -> dict:
+    user = user or {}
+    row = {f'{prefix}{k}': user.get(k) for k, _ in USER_FIELDS}
+    row[f'{prefix}created_at'] = parse_date(user.get('created_at'))
+    return row
+
+
+def tweet_row(tweet: dict) -> dict:
+    row = {k: tweet.get(k) for k, t in TWEET_FIELDS if not k.startswith('user_')}
+    row['created_at'] = parse_date(tweet.get('created_at'))
+    row['retweeted_status_id'] = (tweet.get('retweeted_status') or {}).get('id')
+    row['quoted_status_id'] = (tweet.get('quoted_status') or {}).get('id')
+    row['media'] = orjson.dumps(tweet['media']).decode() if tweet.get('media') else None
+    row |= user_row(tweet.get('user'), prefix='user_')
+    return row
+
+
+def schema(fields: list[tuple[str, str]]) -> 'pa.Schema':
+    types = {
+        'int64': pa.int64(),
+        'string': pa.string(),
+        'json': pa.string(),
+        'bool': pa.bool_(),
+        'timestamp': pa.timestamp('s', tz='UTC'),
+        'list<string>': pa.list_(pa.string()),
+        'list<url>': pa.list_(pa.struct([('expanded_url', pa.string()), ('url', pa.string())])),
+    }
+    return pa.schema([(k, types[t]) for k, t in fields])
+
+
+class ParquetExporter:
+    """
+    Columnar export of transformed tweets and users
+
+    Records from `transform.build_tweet` / `transform.build_user` are accumulated into record batches
+    of `batch_size` rows and written to Parquet, partitioned by month (hive-style) by default:
+
+        {path}/tweets/month=2023-10/part-{run}-{seq:05d}.parquet  (tweet creation date)
+        {path}/users/month=2023-10/part-{run}-{seq:05d}.parquet  (export date, users are snapshots)
+
+    Nested user fields are flattened to `user_*` columns, retweeted/quoted tweets are referenced by id.
+    """
+
+    def __init__(self, path: str | Path, batch_size: int = BATCH_SIZE, compression: str = 'zstd',
+                 max_open_writers: int = MAX_OPEN_WRITERS, partition: str | None = 'month'):
+        """
+        @param path: output directory
+        @param batch_size: number of rows per record batch
+        @param compression: Parquet compression codec
+        @param partition: partition granularity, one of {"day", "month", "year"}, or None for no partitioning.
+            finer partitions split every batch into more, smaller files
+        @param max_open_writers: max number of partition files kept open, least recently used ones are closed
+        """
+        if pa is None:
+            raise ImportError('pyarrow is required for Parquet export: pip install twitter-api-client[parquet]')
+        if partition is not None and partition not in PARTITIONS:
+            raise ValueError(f'Invalid partition {partition!r}, expected one of {list(PARTITIONS)} or None')
+        self.path = Path(path)
+        self.partition = PARTITIONS.get(partition)
+        self.batch_size = batch_size
+        self.compression = compression
+        self.max_open_writers = max_open_writers
+        self.schemas = {'tweets': schema(TWEET_FIELDS), 'users': schema(USER_FIELDS)}
+        self.rows = {'tweets': [], 'users': []}
+        self.writers = OrderedDict()  # (kind, partition dir) -> ParquetWriter
+        self.run = time.time_ns()
+        self.seq = 0
+        self.count = {'tweets': 0, 'users': 0}
+
+    def add_tweets(self, tweets: Iterable[dict]):
+        """
+        @param tweets: records from `transform.build_tweet`
+        """
+        for t in tweets:
+            if t:
+                self._add('tweets', tweet_row(t))
+
+    def add_users(self, users: Iterable[dict]):
+        """
+        @param users: records from `transform.build_user`
+        """
+        for u in users:
+            if u:
+                self._add('users', user_row(u))
+
+    def add_pages(self, pages: Iterable[dict], copy: bool = True):
+        """
+        Transform and add all tweets and users found in raw GraphQL responses
+
+        Users are only added when found on their own (e.g. `Followers`, or the `UserByScreenName`, `UserByRestId` and
+        `UsersByRestIds` lookups), authors are kept as `user_*` columns of their tweets.
+
+        @param pages: raw GraphQL responses (decoded)
+        @param copy: transform a copy of each page. `build_tweet` / `build_user` modify their input in place, pass
+            False only for pages that are not used afterwards
+        """
+        for data in pages:
+            if copy:
+                data = orjson.loads(orjson.dumps(data))
+            found = find_keys(data, ('tweet_results', 'tweetResult', 'user_results'))
+            tweets = [*found['tweet_results'], *found['tweetResult']]
+            self.add_tweets(self._build(build_tweet, tweets))
+            if not tweets:
+                self.add_users(self._build(build_user, found['user_results'] or self._lookup_users(data)))
+
+    def flush(self):
+        """Write all buffered rows, even if there are fewer than `batch_size`"""
+        for kind in self.rows:
+            self._write(kind)
+
+    def close(self):
+        """Flush buffered rows and close all partition files"""
+        self.flush()
+        while self.writers:
+            self.writers.popitem(last=False)[1].close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @staticmethod
+    def _build(fn, objs: list) -> list:
+        res = []
+        for obj in objs:
+            try:
+                res.append(fn(obj))
+            except Exception:
+                ...  # unsupported result types, e.g. tombstones
+        return res
+
+    @staticmethod
+    def _lookup_users(data: dict) -> list:
+        # user lookups return `data.user.result` or `data.users[].result` instead of `user_results`
+        data = data.get('data') if isinstance(data, dict) else None
+        if not isinstance(data, dict):
+            return []
+        return [u for u in (data.get('user'), *(data.get('users') or [])) if u]
+
+    def _add(self, kind: str, row: dict):
+        rows = self.rows[kind]
+        rows.append(row)
+        if len(rows) >= self.batch_size:
+            self._write(kind)
+
+    def _write(self, kind: str):
+        rows, self.rows[kind] = self.rows[kind], []
+        if not rows:
+            return
+        partitions = {}
+        if self.partition:
+            key, fmt = self.partition
+            now = datetime.now(timezone.utc)
+            for row in rows:
+                date = row['created_at'] if kind == 'tweets' and row['created_at'] else now
+                partitions.setdefault(f'{key}={date.strftime(fmt)}', []).append(row)
+        else:
+            partitions[''] = rows
+        for part, L in partitions.items():
+            batch = pa.RecordBatch.from_pylist(L, schema=self.schemas[kind])
+            self._writer(kind, part).write_batch(batch)
+        self.count[kind] += len(rows)
+
+    def _writer(self, kind: str, part: str) -> 'pq.ParquetWriter':
+        key = (kind, part)
+        if writer := self.writers.get(key):
+            self.writers.move_to_end(key)
+            return writer
+        while len(self.writers) >= self.max_open_writers:
+            self.writers.popitem(last=False)[1].close()
+        out = self.path / kind / part
+        out.mkdir(parents=True, exist_ok=True)
+        self.seq += 1
+        writer = pq.ParquetWriter(out / f'part-{self.run}-{self.seq:05d}.parquet', self.schemas[kind],
+                                  compression=self.compression)
+        self.writers[key] = writer
+        return writer
+
+
+def export_archive(path: str | Path, out: str | Path, name: str = None, **kwargs) -> dict:
+    """
+    Export tweets and users from an archive of raw responses (see `ArchiveWriter`) to Parquet
+
+    @param path: archive root, e.g. `data/raw`
+    @param out: output directory
+    @param name: optional operation name, defaults to all operations
+    @param kwargs: optional keyword arguments for `ParquetExporter`
+    @return: number of rows written per kind
+    """
+    with ParquetExporter(out, **kwargs) as exporter:
+        exporter.add_pages((r['data'] for r in iter_archive(path, name)), copy=False)
+    return exporter.count
@@ -0,0 +1,167 @@
+import math
+import threading
+from bisect import bisect_left
+from collections import Counter
+from pathlib import Path
+from typing import Callable
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)  # seconds
+SIZE_BUCKETS = (1_024, 10_240, 102_400, 524_288, 1_048_576, 5_242_880, 10_485_760)  # bytes
+PAGE_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1_000)
+
+
+class Histogram:
+    """Cumulative histogram, in the Prometheus sense"""
+
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last one is +Inf
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> list[tuple[str, int]]:
+        res, total = [], 0
+        for le, n in zip((*self.buckets, '+Inf'), self.counts):
+            total += n
+            res.append((str(le), total))
+        return res
+
+
+class Metrics:
+    """
+    Request instrumentation, per operation
+
+    Tracks request counts (by status), latency, response sizes, errors, retries, pages per query and the
+    remaining rate limit budget. Every event is also passed to the registered hooks as `hook(event, data)`,
+    with `event` one of 'request', 'error', 'retry', 'query'.
+
+    `prometheus()` renders everything in the Prometheus text format.
+    """
+
+    def __init__(self, hooks: list[Callable[[str, dict], None]] = None, prefix: str = 'twitter'):
+        """
+        @param hooks: callables receiving `(event, data)` for every event
+        @param prefix: metric name prefix
+        """
+        self.hooks = list(hooks or [])
+        self.prefix = prefix
+        self.requests = Counter()  # (operation, status)
+        self.errors = Counter()  # (operation, error)
+        self.retries = Counter()  # (operation, reason)
+        self.latency = {}  # operation -> Histogram
+        self.sizes = {}  # operation -> Histogram
+        self.pages = {}  # operation -> Histogram
+        self.remaining = {}  # operation -> remaining rate limit budget
+        self._lock = threading.Lock()
+
+    def add_hook(self, hook: Callable[[str, dict], None]):
+        self.hooks.append(hook)
+
+    def request(self, operation: str, status: int, elapsed: float, size: int, remaining: float = None):
+        """
+        Record a completed request
+
+        @param operation: operation name
+        @param status: response status code
+        @param elapsed: seconds from sending the request to receiving the full response
+        @param size: response size in bytes
+        @param remaining: remaining rate limit budget for the operation, if known
+        """
+        with self._lock:
+            self.requests[operation, status] += 1
+            self._histogram(self.latency, operation, LATENCY_BUCKETS).observe(elapsed)
+            self._histogram(self.sizes, operation, SIZE_BUCKETS).observe(size)
+            if remaining is not None and math.isfinite(remaining):
+                self.remaining[operation] = remaining
+        self._emit('request', operation=operation, status=status, elapsed=elapsed, size=size, remaining=remaining)
+
+    def response(self, operation: str, r, elapsed: float):
+        """
+        Record a completed request from its response, the remaining budget is read from `x-rate-limit-remaining`
+
+        @param operation: operation name
+        @param r: response, read to completion
+        @param elapsed: seconds the request took
+        """
+        try:
+            remaining = int(r.headers['x-rate-limit-remaining'])
+        except (KeyError, ValueError):
+            remaining = None
+        self.request(operation, r.status_code, elapsed, len(r.content), remaining)
+
+    def error(self, operation: str, e: BaseException):
+        """Record a request that failed without a response"""
+        with self._lock:
+            self.errors[operation, type(e).__name__] += 1
+        self._emit('error', operation=operation, error=e)
+
+    def retry(self, operation: str, reason: str | int):
+        """Record a retry, `reason` is a status code or an error name"""
+        with self._lock:
+            self.retries[operation, str(reason)] += 1
+        self._emit('retry', operation=operation, reason=reason)
+
+    def query(self, operation: str, pages: int):
+        """Record a completed (or abandoned) paginated query"""
+        with self._lock:
+            self._histogram(self.pages, operation, PAGE_BUCKETS).observe(pages)
+        self._emit('query', operation=operation, pages=pages)
+
+    def prometheus(self) -> str:
+        """All metrics in the Prometheus text exposition format"""
+        p = self.prefix
+        lines = []
+
+        def header(name: str, kind: str, doc: str):
+            lines.extend((f'# HELP {p}_{name} {doc}', f'# TYPE {p}_{name} {kind}'))
+
+        def histogram(name: str, doc: str, hs: dict):
+            header(name, 'histogram', doc)
+            for op, h in sorted(hs.items()):
+                for le, n in h.cumulative():
+                    lines.append(f'{p}_{name}_bucket{{operation="{op}",le="{le}"}} {n}')
+                lines.append(f'{p}_{name}_sum{{operation="{op}"}} {h.sum}')
+                lines.append(f'{p}_{name}_count{{operation="{op}"}} {h.count}')
+
+        with self._lock:
+            header('requests_total', 'counter', 'Requests by operation and status')
+            for (op, status), n in sorted(self.requests.items()):
+                lines.append(f'{p}_requests_total{{operation="{op}",status="{status}"}} {n}')
+            header('errors_total', 'counter', 'Requests that failed without a response')
+            for (op, err), n in sorted(self.errors.items()):
+                lines.append(f'{p}_errors_total{{operation="{op}",error="{err}"}} {n}')
+            header('retries_total', 'counter', 'Retried requests by operation and reason')
+            for (op, reason), n in sorted(self.retries.items()):
+                lines.append(f'{p}_retries_total{{operation="{op}",reason="{reason}"}} {n}')
+            histogram('request_duration_seconds', 'Request latency', self.latency)
+            histogram('response_size_bytes', 'Response size', self.sizes)
+            histogram('query_pages', 'Pages fetched per query', self.pages)
+            header('rate_limit_remaining', 'gauge', 'Remaining rate limit budget')
+            for op, n in sorted(self.remaining.items()):
+                lines.append(f'{p}_rate_limit_remaining{{operation="{op}"}} {n}')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path: str | Path):
+        """Write `prometheus()` to a file, e.g. for the node exporter textfile collector"""
+        path = Path(path)
+        tmp = path.with_suffix(path.suffix + '.tmp')
+        tmp.write_text(self.prometheus())
+        tmp.replace(path)
+
+    @staticmethod
+    def _histogram(hs: dict, operation: str, buckets: tuple) -> Histogram:
+        if (h := hs.get(operation)) is None:
+            h = hs[operation] = Histogram(buckets)
+        return h
+
+    def _emit(self, event: str, **data):
+        for hook in self.hooks:
+            try:
+                hook(event, data)
+            except Exception as e:
+                print(f'Metrics hook {hook} failed on {event}\n{e}')
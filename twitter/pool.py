@@ -0,0 +1,174 @@
+import asyncio
+from pathlib import Path
+
+import orjson
+from httpx import AsyncClient, Client, Response
+
+from .breaker import CircuitBreaker, CircuitOpenError, failed
+from .ratelimit import RateLimiter, Signal
+from .util import cookie_version, get_headers, init_session
+
+
+def load_session(session: Client | dict | str | Path) -> Client:
+    """
+    Create a session from a `Client`, a cookies dict, or a path to a cookies (JSON) file
+    """
+    if isinstance(session, Client):
+        return session
+    cookies = session if isinstance(session, dict) else orjson.loads(Path(session).read_bytes())
+    _session = Client(cookies=cookies, follow_redirects=True)
+    _session.headers.update(get_headers(_session))
+    return _session
+
+
+class PersistentClient:
+    """
+    `AsyncClient` created on first use and reused across calls
+
+    Connections are bound to the event loop they were opened on, so a new client is created
+    if used from a different loop.
+    """
+
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+        self._client = None
+        self._loop = None
+
+    def get(self) -> AsyncClient:
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client.is_closed or self._loop is not loop:
+            self._client = AsyncClient(**self.kwargs)
+            self._loop = loop
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None and self._loop is asyncio.get_running_loop():
+            await self._client.aclose()
+        self._client = self._loop = None
+
+
+class Member:
+    """A single session in a `SessionPool`, with its own rate limit state, circuit breakers and persistent client"""
+
+    def __init__(self, session: Client, guest: bool = False, limiter: RateLimiter = None, breaker: dict = None, **kwargs):
+        self.session = session
+        self.guest = guest
+        self.limiter = limiter or RateLimiter()
+        self.breaker_kwargs = breaker or {}
+        self.breakers = {}
+        self.transport = PersistentClient(headers=self.headers, cookies=session.cookies, **kwargs)
+        self.active = True
+        self._version = None
+
+    def breaker(self, name: str) -> CircuitBreaker:
+        if (b := self.breakers.get(name)) is None:
+            b = self.breakers[name] = CircuitBreaker(**self.breaker_kwargs)
+        return b
+
+    @property
+    def headers(self) -> dict:
+        return self.session.headers if self.guest else get_headers(self.session)
+
+    @property
+    def client(self) -> AsyncClient:
+        client = self.transport.get()
+        # the client keeps its own cookies, e.g. a rotated `ct0`. keep the csrf/cookie headers in sync with them
+        if not self.guest and (version := cookie_version(client)) != self._version:
+            client.headers.update(get_headers(client))
+            self._version = version
+        return client
+
+    def __repr__(self):
+        name = 'guest' if self.guest else self.session.cookies.get('username') or self.session.cookies.get('twid')
+        return f'Member({name}, active={self.active})'
+
+
+class SessionPool:
+    """
+    Spread requests across several sessions
+
+    Each request is routed to the active session with the most remaining budget for its operation.
+    Sessions that are rejected with a 401 are removed from rotation, except the last active one, and sessions
+    whose circuit is open for an operation are skipped for that operation. If the circuit is open for every session, requests
+    fail fast with `CircuitOpenError`.
+    """
+
+    def __init__(self, breaker: dict = None, **kwargs):
+        """
+        @param breaker: optional keyword arguments for each `CircuitBreaker`
+        @param kwargs: optional keyword arguments for each session's `AsyncClient`
+        """
+        self.signal = Signal()
+        self.members = []
+        self.revoked = 0  # number of sessions removed from rotation after a 401
+        self.breaker_kwargs = breaker
+        self.client_kwargs = kwargs
+
+    def add(self, session: Client | dict | str | Path, guest: bool = None, limiter: RateLimiter = None) -> Member:
+        session = load_session(session)
+        if guest is None:
+            guest = not session.cookies.get('auth_token')
+        limiter = limiter or RateLimiter()
+        limiter.signal = self.signal
+        member = Member(session, guest, limiter, self.breaker_kwargs, **self.client_kwargs)
+        self.members.append(member)
+        return member
+
+    def add_guests(self, n: int):
+        for _ in range(n):
+            self.add(init_session(), guest=True)
+
+    @property
+    def active(self) -> list[Member]:
+        return [m for m in self.members if m.active]
+
+    def remaining(self, name: str) -> float:
+        """Total remaining budget for an operation across all active sessions"""
+        return sum(m.limiter.remaining(name) for m in self.active)
+
+    def healthy(self, name: str) -> bool:
+        """Whether any active session can currently serve an operation"""
+        return any(not m.breaker(name).tripped() for m in self.active)
+
+    def health(self) -> dict:
+        """Circuit breaker state per session and operation"""
+        return {repr(m): {name: b.status() for name, b in m.breakers.items()} for m in self.members}
+
+    async def acquire(self, name: str) -> Member:
+        while True:
+            members = self.active
+            if not members:
+                raise Exception('No active sessions in pool')
+            if not self.healthy(name):
+                retry_in = min(m.breaker(name).retry_in() for m in members)
+                raise CircuitOpenError(f'Circuit open for {name} on all sessions, next probe in {retry_in:.0f}s')
+            ready = [m for m in members if m.breaker(name).ready()]
+            for m in sorted(ready, key=lambda m: -m.limiter.remaining(name)):
+                if m.limiter.try_acquire(name):
+                    m.breaker(name).allow()
+                    return m
+            # wait for a token, or for an in-flight half-open probe to complete
+            delays = [d for m in ready if (d := m.limiter.delay(name)) is not None]
+            await self.signal.wait(min(delays) if delays else None)
+
+    def release(self, member: Member, name: str, error: bool = False):
+        """Give back a token without a response, e.g. when the request failed"""
+        if error:
+            member.breaker(name).record(False)
+        member.limiter.release(name)
+
+    def update(self, member: Member, name: str, r: Response):
+        if r.status_code == 401 and member.active and len(self.active) > 1:
+            # the last session is kept, its 401s are returned to the caller as before
+            member.active = False
+            self.revoked += 1
+        if r.status_code in {401, 429, 431}:
+            # says nothing about the health of the endpoint
+            member.breaker(name).cancel()
+        else:
+            member.breaker(name).record(not failed(r))
+        member.limiter.update(name, r)
+
+    async def aclose(self):
+        for m in self.members:
+            await m.transport.aclose()
@@ -0,0 +1,144 @@
+import asyncio
+import math
+import time
+
+from .constants import MAX_ENDPOINT_LIMIT, RATE_LIMIT_WINDOW
+from .retry import RetryPolicy
+
+
+class Signal:
+    """
+    Broadcast notification that can be awaited with a timeout.
+
+    The underlying `asyncio.Event` is bound to whichever loop is running,
+    so a single instance survives across separate `asyncio.run` calls.
+    """
+
+    def __init__(self):
+        self._loop = None
+        self._event = None
+
+    def _get(self) -> asyncio.Event:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop, self._event = loop, asyncio.Event()
+        return self._event
+
+    def notify(self):
+        if self._event is not None:
+            self._event.set()
+            self._event = asyncio.Event()
+
+    async def wait(self, timeout: float = None):
+        try:
+            await asyncio.wait_for(self._get().wait(), timeout)
+        except asyncio.TimeoutError:
+            ...
+
+
+class Bucket:
+    """
+    Rate limit state of a single operation
+
+    `remaining` and `reset` mirror the last `x-rate-limit-*` headers seen.
+    `inflight` counts requests sent but not yet answered, so tokens are not spent twice.
+    """
+
+    def __init__(self):
+        self.limit = None
+        self.remaining = None
+        self.reset = None
+        self.inflight = 0
+
+    @property
+    def known(self) -> bool:
+        return self.remaining is not None
+
+    def refill(self, now: float):
+        if self.reset is not None and now >= self.reset:
+            self.remaining = self.limit
+            self.reset = None
+
+    def available(self, now: float) -> int:
+        self.refill(now)
+        if not self.known:
+            # probe with a single request until the server tells us the budget
+            return 1 - self.inflight
+        return self.remaining - self.inflight
+
+    def delay(self, now: float) -> float | None:
+        """Seconds until a token is expected, or None if waiting on in-flight requests"""
+        if self.available(now) > 0:
+            return 0
+        if self.known and self.reset is not None and self.remaining <= 0:
+            return max(self.reset - now, 0)
+
+
+class RateLimiter:
+    """
+    Per-operation token bucket driven by the `x-rate-limit-*` response headers
+
+    Instead of truncating large inputs, every request acquires a token for its operation.
+    When the budget for the current window is spent, requests are queued until `x-rate-limit-reset`.
+    """
+
+    def __init__(self, default_limit: int = MAX_ENDPOINT_LIMIT, margin: float = 1.0, signal: Signal = None):
+        self.default_limit = default_limit
+        self.margin = margin
+        self.signal = signal or Signal()
+        self.buckets = {}
+
+    def bucket(self, name: str) -> Bucket:
+        if (b := self.buckets.get(name)) is None:
+            b = self.buckets[name] = Bucket()
+        return b
+
+    def remaining(self, name: str) -> float:
+        """Remaining budget for an operation, `math.inf` if not yet known"""
+        b = self.bucket(name)
+        b.refill(time.time())
+        return math.inf if not b.known else b.remaining - b.inflight
+
+    def try_acquire(self, name: str) -> bool:
+        b = self.bucket(name)
+        if b.available(time.time()) > 0:
+            b.inflight += 1
+            return True
+        return False
+
+    def delay(self, name: str) -> float | None:
+        d = self.bucket(name).delay(time.time())
+        return d if d is None else d + self.margin * bool(d)
+
+    async def acquire(self, name: str):
+        while not self.try_acquire(name):
+            await self.signal.wait(self.delay(name))
+
+    def release(self, name: str):
+        """Give back a token without a response, e.g. when the request failed"""
+        b = self.bucket(name)
+        b.inflight = max(b.inflight - 1, 0)
+        self.signal.notify()
+
+    def update(self, name: str, r):
+        """Record the rate limit headers of a response to a request made with `acquire`"""
+        b = self.bucket(name)
+        b.inflight = max(b.inflight - 1, 0)
+        headers = r.headers
+        try:
+            now = time.time()
+            if (remaining := headers.get('x-rate-limit-remaining')) is not None:
+                b.remaining = int(remaining)
+                b.limit = int(headers.get('x-rate-limit-limit', b.limit or self.default_limit))
+                b.reset = int(headers.get('x-rate-limit-reset', now + RATE_LIMIT_WINDOW))
+            elif r.status_code == 429:
+                b.limit = b.limit or self.default_limit
+                b.remaining = 0
+                b.reset = now + (RetryPolicy.server_delay(r) or RATE_LIMIT_WINDOW)
+            elif not b.known:
+                # endpoint does not report limits, fall back to the default window
+                b.limit = b.remaining = self.default_limit
+                b.reset = now + RATE_LIMIT_WINDOW
+        except ValueError:
+            ...
+        self.signal.notify()
@@ -0,0 +1,69 @@
+import random
+import time
+from email.utils import parsedate_to_datetime
+
+from httpx import TransportError
+
+from .constants import RATE_LIMIT_WINDOW
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class RetryPolicy:
+    """
+    When and how long to wait before retrying a request
+
+    - `Retry-After` is honored when present (seconds or HTTP date)
+    - 429s wait until `x-rate-limit-reset`
+    - 5xx and network errors use exponential backoff with full jitter
+    """
+
+    def __init__(self, retries: int = 5, base: float = 1.0, cap: float = 60.0, max_delay: float = RATE_LIMIT_WINDOW + 5):
+        """
+        @param retries: max number of retries per request
+        @param base: backoff base in seconds
+        @param cap: max backoff in seconds, for transient errors
+        @param max_delay: max delay in seconds, for server-provided delays
+        """
+        self.retries = retries
+        self.base = base
+        self.cap = cap
+        self.max_delay = max_delay
+
+    @staticmethod
+    def retryable(r=None, e: Exception = None) -> bool:
+        """
+        @param r: response, if any
+        @param e: exception raised by the request, if any
+        """
+        if e is not None:
+            return isinstance(e, TransportError)
+        return r is not None and r.status_code in RETRY_STATUS
+
+    def delay(self, attempt: int, r=None) -> float:
+        """
+        Seconds to wait before the next attempt
+
+        @param attempt: number of attempts so far, starting at 0
+        @param r: response of the last attempt, if any
+        """
+        if r is not None and (t := self.server_delay(r)) is not None:
+            return min(max(t, 0), self.max_delay)
+        return random.uniform(0, min(self.cap, self.base * 2 ** attempt))
+
+    @staticmethod
+    def server_delay(r) -> float | None:
+        """Delay requested by the server, if any"""
+        if ra := r.headers.get('retry-after'):
+            try:
+                return float(ra)
+            except ValueError:
+                try:
+                    return parsedate_to_datetime(ra).timestamp() - time.time()
+                except (TypeError, ValueError):
+                    ...
+        if r.status_code == 429 and (reset := r.headers.get('x-rate-limit-reset')):
+            try:
+                return int(reset) - time.time()
+            except ValueError:
+                ...
@@ -3,14 +3,23 @@ import logging.config
 import math
 import platform
 from functools import partial
-from typing import Generator
+from typing import AsyncGenerator, Callable
 
 import websockets
 from httpx import AsyncClient, Limits, ReadTimeout, URL
 from tqdm.asyncio import tqdm_asyncio
 
+from .archive import ArchiveWriter, SEGMENT_SIZE
+from .batch import Batcher
+from .cache import ResponseCache
+from .checkpoint import CheckpointStore
 from .constants import *
+from .download import Downloader, MediaStore, output_name
 from .login import login
+from .metrics import Metrics
+from .pool import PersistentClient, SessionPool
+from .ratelimit import RateLimiter
+from .retry import RetryPolicy
 from .util import *
 
 try:
@@ -37,8 +46,21 @@ class Scraper:
         self.pbar = kwargs.get('pbar', True)
         self.out = Path(kwargs.get('out', 'data'))
         self.guest = False
+        self.concurrency = kwargs.get('concurrency', MAX_ENDPOINT_LIMIT)
+        self.rate_limiter = kwargs.get('rate_limiter') or RateLimiter()
+        self.batcher = Batcher(kwargs.get('url_limit', MAX_GQL_URL_LENGTH))
+        self.retry = kwargs.get('retry') or RetryPolicy(kwargs.get('retries', 5))
+        self.metrics = kwargs.get('metrics') or Metrics()
+        self._loop = None
+        self._media = None
+        self._inflight = {}
+        self._templates = {}
         self.logger = self._init_logger(**kwargs)
         self.session = self._validate_session(email, username, password, session, **kwargs)
+        self.pool = self._init_pool(**kwargs)
+        self.checkpoints = self._init_checkpoints(**kwargs)
+        self.cache = self._init_cache(**kwargs)
+        self.archive = self._init_archive(**kwargs)
 
     def users(self, screen_names: list[str], **kwargs) -> list[dict]:
         """
@@ -70,7 +92,7 @@ class Scraper:
         @param kwargs: optional keyword arguments
         @return: list of tweet data as dicts
         """
-        return self._run(Operation.TweetResultsByRestIds, batch_ids(tweet_ids), **kwargs)
+        return self._run(Operation.TweetResultsByRestIds, self._batch(Operation.TweetResultsByRestIds, tweet_ids, **kwargs), **kwargs)
 
     def tweets_details(self, tweet_ids: list[int], **kwargs) -> list[dict]:
         """
@@ -200,7 +222,7 @@ class Scraper:
         @param kwargs: optional keyword arguments
         @return: list of user data as dicts
         """
-        return self._run(Operation.UsersByRestIds, batch_ids(user_ids), **kwargs)
+        return self._run(Operation.UsersByRestIds, self._batch(Operation.UsersByRestIds, user_ids, **kwargs), **kwargs)
 
     def recommended_users(self, user_ids: list[int] = None, **kwargs) -> list[dict]:
         """
@@ -246,6 +268,70 @@ class Scraper:
     def list_members(self, list_ids: list[str], **kwargs) -> list[dict]:
         return self._run(Operation.ListMembers, list_ids, **kwargs)
 
+    async def iter_pages(self, operation: tuple, queries: list, lookahead: int = 8, **kwargs) -> AsyncGenerator[dict, None]:
+        """
+        Stream parsed pages as soon as they arrive.
+
+        Unlike the list-returning methods, pages are not kept in memory.
+        At most `lookahead` pages are fetched (or being fetched) ahead of the consumer, however many queries there are.
+        Pages of different queries are interleaved.
+        With checkpoints, a page is committed once the consumer asks for the next one, pages fetched ahead are not.
+
+        e.g.
+        async for page in scraper.iter_pages(Operation.Followers, [123, 234]):
+            ...
+
+        @param operation: operation, e.g. `Operation.Followers`
+        @param queries: list of query values (e.g. user ids) or dicts of variables
+        @param lookahead: max number of pages buffered ahead of the consumer
+        @param kwargs: optional keyword arguments
+        @return: async generator of pages as dicts
+        """
+        queue = asyncio.Queue()
+        done = object()
+        # a permit is taken before fetching a page, and given back once the consumer dequeues it
+        permits = asyncio.Semaphore(lookahead)
+
+        async def produce(q: dict):
+            pages = 0
+            gen = self._pages(operation, **q, **kwargs)
+            try:
+                while True:
+                    await permits.acquire()
+                    try:
+                        r, commit = await anext(gen)
+                    except BaseException:
+                        permits.release()
+                        raise
+                    pages += 1
+                    await queue.put((r.data, commit))
+            except StopAsyncIteration:
+                ...
+            except Exception as e:
+                if self.debug or not self.pool.active:
+                    self.logger.error(f'Failed to get pagination data\n{e}')
+            finally:
+                await gen.aclose()
+                self.metrics.query(operation[-1], pages)
+
+        async def process():
+            await bounded_gather((produce(q) for q in queries), self.concurrency)
+            await queue.put(done)
+
+        queries = self._queries(operation, queries)
+        task = asyncio.create_task(process())
+        try:
+            while (item := await queue.get()) is not done:
+                permits.release()
+                page, commit = item
+                yield page
+                commit and commit()
+        finally:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            if self.archive:
+                await self.archive.flush()
+
     def download_media(self, ids: list[int], photos: bool = True, videos: bool = True, cards: bool = True, hq_img_variant: bool = True, video_thumb: bool = False, out: str = 'media',
                        metadata_out: str = 'media.json', **kwargs) -> dict:
         """
@@ -259,72 +345,74 @@ class Scraper:
         @param video_thumb: download video thumbnails
         @param out: output file for media
         @param metadata_out: output file for media metadata
+        @param kwargs: optional keyword arguments, e.g. `verify=True` to check the size of existing files against the server,
+            `store=True` (or a `MediaStore`) to download media shared by several tweets only once,
+            `workers` (concurrent downloads), `per_host` (concurrent downloads per host), `bandwidth` (max bytes per second),
+            `connections` (ranged requests per large file), `hls=True` to download videos from their HLS playlist
         @return: media data
         """
-
-        async def process(fns: Generator) -> list:
-            limits = {
-                'max_connections': kwargs.pop('max_connections', 1000),
-                'max_keepalive_connections': kwargs.pop('max_keepalive_connections', None),
-                'keepalive_expiry': kwargs.pop('keepalive_expiry', 5.0),
-            }
-            headers = {'user-agent': random.choice(USER_AGENTS)}
-            async with AsyncClient(limits=Limits(**limits), headers=headers, http2=True, verify=False, timeout=60, follow_redirects=True) as client:
-                return await tqdm_asyncio.gather(*(fn(client=client) for fn in fns), desc='Downloading Media')
-
-        def download(urls: list[tuple], out: str) -> Generator:
-            out = Path(out)
+        return self._sync(self._download_media(ids, photos, videos, cards, hq_img_variant, video_thumb, out, metadata_out, **kwargs))
+
+    async def _download_media(self, ids: list[int], photos: bool, videos: bool, cards: bool, hq_img_variant: bool, video_thumb: bool, out: str,
+                              metadata_out: str, **kwargs) -> dict:
+        limits = {
+            'max_connections': kwargs.pop('max_connections', 1000),
+            'max_keepalive_connections': kwargs.pop('max_keepalive_connections', None),
+            'keepalive_expiry': kwargs.pop('keepalive_expiry', 5.0),
+        }
+        out = Path(out)
+        # download options, not query variables
+        chunk_size = kwargs.pop('chunk_size', None)
+        verify = kwargs.pop('verify', False)
+        store = kwargs.pop('store', None)
+        workers = kwargs.pop('workers', 32)
+        per_host = kwargs.pop('per_host', 16)
+        bandwidth = kwargs.pop('bandwidth', None)
+        connections = kwargs.pop('connections', 1)
+        hls = kwargs.pop('hls', False)
+
+        async def process(items: AsyncGenerator, total: int = None) -> dict:
             out.mkdir(parents=True, exist_ok=True)
-            chunk_size = kwargs.pop('chunk_size', None)
-
-            async def get(client: AsyncClient, url: str):
-                tid, cdn_url = url
-                ext = urlsplit(cdn_url).path.split('/')[-1]
-                fname = out / f'{tid}_{ext}'
-                async with aiofiles.open(fname, 'wb') as fp:
-                    async with client.stream('GET', cdn_url) as r:
-                        async for chunk in r.aiter_raw(chunk_size):
-                            await fp.write(chunk)
-
-            return (partial(get, url=u) for u in urls)
-
-        tweets = self.tweets_by_ids(ids, **kwargs)
-        media = {}
-        for data in tweets:
-            for tweet in data.get('data', {}).get('tweetResult', []):
-                if _id := tweet.get('result', {}).get('rest_id'):
-
-                    date = tweet.get('result', {}).get('legacy', {}).get('created_at', '')
-                    uid = tweet.get('result', {}).get('legacy', {}).get('user_id_str', '')
-                    media[_id] = {'date': date, 'uid': uid, 'img': set(), 'video': {'thumb': set(), 'video_info': {}, 'hq': set()}, 'card': []}
-
-                    for _media in (y for x in find_key(tweet['result'], 'media') for y in x if isinstance(x, list)):
-                        if videos:
-                            if vinfo := _media.get('video_info'):
-                                hq = sorted(vinfo.get('variants', []), key=lambda x: -x.get('bitrate', 0))[0]['url']
-                                media[_id]['video']['video_info'] |= vinfo
-                                media[_id]['video']['hq'].add(hq)
-
-                        if video_thumb:
-                            if url := _media.get('media_url_https', ''):
-                                media[_id]['video']['thumb'].add(url)
-
-                        if photos:
-                            if (url := _media.get('media_url_https', '')) and "_video_thumb" not in url:
-                                if hq_img_variant:
-                                    url = f'{url}?name=orig'
-                                media[_id]['img'].add(url)
-                    if cards:
-                        if card := tweet.get('result', {}).get('card', {}).get('legacy', {}):
-                            media[_id]['card'].extend(card.get('binding_values', []))
-        if metadata_out:
-            media = set2list(media)
-            metadata_out = Path(metadata_out)
-            metadata_out.parent.mkdir(parents=True, exist_ok=True)  # if user specifies subdir
-            metadata_out.write_bytes(orjson.dumps(media))
+            downloader = Downloader(self._media_client(limits).get(), workers=workers, per_host=per_host, bandwidth=bandwidth,
+                                    chunk_size=chunk_size, verify=verify, connections=connections, desc='Downloading Media',
+                                    store=store if isinstance(store, MediaStore) else MediaStore(out) if store else None)
+            # complete files are skipped, partial ones (`.part`) resumed
+            stats = await downloader.run(items, total)
+            if self.debug:
+                for url, fname, e in downloader.failed:
+                    self.logger.error(f'Failed to download {url}\n{e}')
+                self.logger.debug(f'Media: {stats}')
+            return stats
+
+        def extract(tweet: dict) -> dict:
+            date = tweet.get('result', {}).get('legacy', {}).get('created_at', '')
+            uid = tweet.get('result', {}).get('legacy', {}).get('user_id_str', '')
+            res = {'date': date, 'uid': uid, 'img': set(), 'video': {'thumb': set(), 'video_info': {}, 'hq': set()}, 'card': []}
+
+            for _media in (y for x in find_key(tweet['result'], 'media') for y in x if isinstance(x, list)):
+                if videos:
+                    if vinfo := _media.get('video_info'):
+                        variants = vinfo.get('variants', [])
+                        streams = [x for x in variants if x.get('content_type') == 'application/x-mpegURL']
+                        hq = streams[0]['url'] if hls and streams else sorted(variants, key=lambda x: -x.get('bitrate', 0))[0]['url']
+                        res['video']['video_info'] |= vinfo
+                        res['video']['hq'].add(hq)
+
+                if video_thumb:
+                    if url := _media.get('media_url_https', ''):
+                        res['video']['thumb'].add(url)
+
+                if photos:
+                    if (url := _media.get('media_url_https', '')) and "_video_thumb" not in url:
+                        if hq_img_variant:
+                            url = f'{url}?name=orig'
+                        res['img'].add(url)
+            if cards:
+                if card := tweet.get('result', {}).get('card', {}).get('legacy', {}):
+                    res['card'].extend(card.get('binding_values', []))
+            return res
 
-        res = []
-        for k, v in media.items():
+        def urls(v: dict) -> list[str]:
             tmp = []
             if photos:
                 tmp.extend(v['img'])
@@ -334,8 +422,41 @@ class Scraper:
                 tmp.extend(v['video']['thumb'])
             if cards:
                 tmp.extend(parse_card_media(v['card']))
-            res.extend([(k, m) for m in tmp])
-        asyncio.run(process(download(res, out)))
+            return tmp
+
+        media = {}
+
+        async def items() -> AsyncGenerator[tuple, None]:
+            """
+            Media of each batch, queued for download as soon as the batch arrives, while later batches are fetched
+
+            Metadata is streamed to `metadata_out` as a JSON object, one tweet at a time.
+            """
+            fp = None
+            if metadata_out:
+                path = Path(metadata_out)
+                path.parent.mkdir(parents=True, exist_ok=True)  # if user specifies subdir
+                fp = path.open('wb')
+                fp.write(b'{')
+            try:
+                batches = self._batch(Operation.TweetResultsByRestIds, ids, **kwargs)
+                async for data in self.iter_pages(Operation.TweetResultsByRestIds, batches, **kwargs):
+                    for tweet in data.get('data', {}).get('tweetResult', []):
+                        if (_id := tweet.get('result', {}).get('rest_id')) and _id not in media:
+                            v = extract(tweet)
+                            if fp:
+                                media[_id] = set2list(v)
+                                fp.write(b'%s%s:%s' % (b',' if len(media) > 1 else b'', orjson.dumps(_id), orjson.dumps(media[_id])))
+                            else:
+                                media[_id] = v
+                            for cdn_url in urls(v):
+                                yield cdn_url, out / f'{_id}_{output_name(cdn_url)}'
+            finally:
+                if fp:
+                    fp.write(b'}')
+                    fp.close()
+
+        await process(items())
         return media
 
     def trends(self, utc: list[str] = None) -> dict:
@@ -345,11 +466,12 @@ class Scraper:
         @param utc: optional list of specific UTC offsets
         @return: dict of trends
         """
+        return self._sync(self._trends(utc))
 
+    async def _trends(self, utc: list[str] = None) -> dict:
         async def get_trends(client: AsyncClient, offset: str, url: str):
             try:
-                client.headers['x-twitter-utcoffset'] = offset
-                r = await client.get(url)
+                r = await client.get(url, headers={'x-twitter-utcoffset': offset})
                 trends = find_key(r.json(), 'item')
                 return {t['content']['trend']['name']: t for t in trends}
             except Exception as e:
@@ -361,18 +483,22 @@ class Scraper:
             offsets = utc or ["-1200", "-1100", "-1000", "-0900", "-0800", "-0700", "-0600", "-0500", "-0400", "-0300",
                               "-0200", "-0100", "+0000", "+0100", "+0200", "+0300", "+0400", "+0500", "+0600", "+0700",
                               "+0800", "+0900", "+1000", "+1100", "+1200", "+1300", "+1400"]
-            async with AsyncClient(headers=get_headers(self.session)) as client:
-                tasks = (get_trends(client, o, url) for o in offsets)
-                if self.pbar:
-                    return await tqdm_asyncio.gather(*tasks, desc='Getting trends')
-                return await asyncio.gather(*tasks)
-
-        trends = asyncio.run(process())
-        out = self.out / 'raw' / 'trends'
-        out.mkdir(parents=True, exist_ok=True)
-        (out / f'{time.time_ns()}.json').write_text(orjson.dumps(
-            {k: v for d in trends for k, v in d.items()},
-            option=orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS).decode(), encoding='utf-8')
+            client = self._client()
+            tasks = (get_trends(client, o, url) for o in offsets)
+            if self.pbar:
+                return await tqdm_asyncio.gather(*tasks, desc='Getting trends')
+            return await asyncio.gather(*tasks)
+
+        trends = await process()
+        data = {k: v for d in trends for k, v in d.items()}
+        if self.archive:
+            await self.archive.write('trends', orjson.dumps(data, option=orjson.OPT_SORT_KEYS), {'utc': utc})
+            await self.archive.flush()
+        else:
+            out = self.out / 'raw' / 'trends'
+            out.mkdir(parents=True, exist_ok=True)
+            (out / f'{time.time_ns()}.json').write_text(orjson.dumps(
+                data, option=orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS).decode(), encoding='utf-8')
         return trends
 
     def spaces(self, *, rooms: list[str] = None, search: list[dict] = None, audio: bool = False, chat: bool = False,
@@ -390,18 +516,22 @@ class Scraper:
         @param kwargs: optional keyword arguments
         @return: list of spaces data
         """
+        return self._sync(self._spaces(rooms=rooms, search=search, audio=audio, chat=chat, **kwargs))
+
+    async def _spaces(self, *, rooms: list[str] = None, search: list[dict] = None, audio: bool = False, chat: bool = False,
+                      **kwargs) -> list[dict]:
         if rooms:
-            spaces = self._run(Operation.AudioSpaceById, rooms, **kwargs)
+            spaces = await self._arun(Operation.AudioSpaceById, rooms, **kwargs)
         else:
-            res = self._run(Operation.AudioSpaceSearch, search, **kwargs)
+            res = await self._arun(Operation.AudioSpaceSearch, search, **kwargs)
             search_results = set(find_key(res, 'rest_id'))
-            spaces = self._run(Operation.AudioSpaceById, search_results, **kwargs)
+            spaces = await self._arun(Operation.AudioSpaceById, search_results, **kwargs)
         if audio or chat:
-            return self._get_space_data(spaces, audio, chat)
+            return await self._get_space_data(spaces, audio, chat)
         return spaces
 
-    def _get_space_data(self, spaces: list[dict], audio=True, chat=True):
-        streams = self._check_streams(spaces)
+    async def _get_space_data(self, spaces: list[dict], audio=True, chat=True):
+        streams = await self._check_streams(spaces)
         chat_data = None
         if chat:
             temp = []  # get necessary keys instead of passing large dicts
@@ -414,17 +544,17 @@ class Scraper:
                         'media_key': meta['media_key'],
                         'state': meta['state'],
                     })
-            chat_data = self._get_chat_data(temp)
+            chat_data = await self._get_chat_data(temp)
         if audio:
             temp = []
             for stream in streams:
                 if stream.get('stream'):
-                    chunks = self._get_chunks(stream['stream']['source']['location'])
+                    chunks = await self._get_chunks(stream['stream']['source']['location'])
                     temp.append({
                         'rest_id': stream['space']['data']['audioSpace']['metadata']['rest_id'],
                         'chunks': chunks,
                     })
-            self._download_audio(temp)
+            await self._download_audio(temp)
         return chat_data
 
     async def _get_stream(self, client: AsyncClient, media_key: str):
@@ -485,11 +615,11 @@ class Scraper:
             parsed.extend(messages)
         return parsed
 
-    def _get_chunks(self, location: str) -> list[str]:
+    async def _get_chunks(self, location: str) -> list[str]:
         try:
             url = URL(location)
             stream_type = url.params.get('type')
-            r = self.session.get(
+            r = await self._client().get(
                 url=location,
                 params={'type': stream_type},
                 headers={'authority': url.host}
@@ -502,7 +632,7 @@ class Scraper:
             if self.debug:
                 self.logger.error(f'Failed to get chunks\n{e}')
 
-    def _get_chat_data(self, keys: list[dict]) -> list[dict]:
+    async def _get_chat_data(self, keys: list[dict]) -> list[dict]:
         async def get(c: AsyncClient, key: dict) -> dict:
             info = await self._init_chat(c, key['chat_token'])
             chat = await self._get_chat(c, info['endpoint'], info['access_token'])
@@ -516,35 +646,29 @@ class Scraper:
 
         async def process():
             (self.out / 'raw').mkdir(parents=True, exist_ok=True)
-            limits = Limits(max_connections=100, max_keepalive_connections=10)
-            headers = self.session.headers if self.guest else get_headers(self.session)
-            cookies = self.session.cookies
-            async with AsyncClient(limits=limits, headers=headers, cookies=cookies, timeout=20) as c:
-                tasks = (get(c, key) for key in keys)
-                if self.pbar:
-                    return await tqdm_asyncio.gather(*tasks, desc='Downloading chat data')
-                return await asyncio.gather(*tasks)
-
-        return asyncio.run(process())
-
-    def _download_audio(self, data: list[dict]) -> None:
+            c = self._client()
+            tasks = (get(c, key) for key in keys)
+            if self.pbar:
+                return await tqdm_asyncio.gather(*tasks, desc='Downloading chat data')
+            return await asyncio.gather(*tasks)
+
+        return await process()
+
+    async def _download_audio(self, data: list[dict]) -> None:
         async def get(s: AsyncClient, chunk: str, rest_id: str) -> tuple:
             r = await s.get(chunk)
             return rest_id, r
 
         async def process(data: list[dict]) -> list:
-            limits = Limits(max_connections=100, max_keepalive_connections=10)
-            headers = self.session.headers if self.guest else get_headers(self.session)
-            cookies = self.session.cookies
-            async with AsyncClient(limits=limits, headers=headers, cookies=cookies, timeout=20) as c:
-                tasks = []
-                for d in data:
-                    tasks.extend([get(c, chunk, d['rest_id']) for chunk in d['chunks']])
-                if self.pbar:
-                    return await tqdm_asyncio.gather(*tasks, desc='Downloading audio')
-                return await asyncio.gather(*tasks)
-
-        chunks = asyncio.run(process(data))
+            c = self._client()
+            tasks = []
+            for d in data:
+                tasks.extend([get(c, chunk, d['rest_id']) for chunk in d['chunks']])
+            if self.pbar:
+                return await tqdm_asyncio.gather(*tasks, desc='Downloading audio')
+            return await asyncio.gather(*tasks)
+
+        chunks = await process(data)
         streams = {}
         [streams.setdefault(_id, []).append(chunk) for _id, chunk in chunks]
         # ensure chunks are in correct order
@@ -557,94 +681,248 @@ class Scraper:
             with open(out / f'{space_id}.aac', 'wb') as fp:
                 [fp.write(c.content) for c in chunks]
 
-    def _check_streams(self, keys: list[dict]) -> list[dict]:
+    async def _check_streams(self, keys: list[dict]) -> list[dict]:
         async def get(c: AsyncClient, space: dict) -> dict:
             media_key = space['data']['audioSpace']['metadata']['media_key']
             stream = await self._get_stream(c, media_key)
             return {'space': space, 'stream': stream}
 
         async def process():
-            limits = Limits(max_connections=100, max_keepalive_connections=10)
-            headers = self.session.headers if self.guest else get_headers(self.session)
-            cookies = self.session.cookies
-            async with AsyncClient(limits=limits, headers=headers, cookies=cookies, timeout=20) as c:
-                return await asyncio.gather(*(get(c, key) for key in keys))
+            c = self._client()
+            return await asyncio.gather(*(get(c, key) for key in keys))
 
-        return asyncio.run(process())
+        return await process()
 
     def _run(self, operation: tuple[dict, str, str], queries, **kwargs):
+        return self._sync(self._arun(operation, queries, **kwargs))
+
+    async def _arun(self, operation: tuple[dict, str, str], queries, **kwargs):
+        # no truncation needed, requests are paced by `self.rate_limiter`
+        # duplicate queries are only requested once, results fan back out in input order
+        keys = [query_key(q) for q in self._queries(operation, queries)]
+        unique = dict(zip(keys, self._queries(operation, queries)))
+        res = dict(zip(unique, await self._process(operation, list(unique.values()), **kwargs)))
+        out, seen = [], set()
+        for k in keys:
+            # duplicates get their own parsed tree, since callers may mutate results
+            out.append(get_json(copy_pages(res[k]) if k in seen else res[k], **kwargs))
+            seen.add(k)
+        if self.archive:
+            await self.archive.flush()
+        return out
+
+    @staticmethod
+    def _queries(operation: tuple[dict, str, str], queries) -> list[dict]:
         keys, qid, name = operation
-        # stay within rate-limits
-        if (l := len(queries)) > MAX_ENDPOINT_LIMIT:
+        if all(isinstance(q, dict) for q in queries):
+            return list(queries)
+        # queries are of type set | list[int|str], need to convert to list[dict]
+        return [{k: q} for q in queries for k, v in keys.items()]
+
+    async def _query(self, operation: tuple, **kwargs) -> Page:
+        keys, qid, name = operation
+        variables = self._template(operation).variables(**kwargs)
+        if self.cache and (r := self.cache.get(name, variables)):
             if self.debug:
-                self.logger.warning(f'Got {l} queries, truncating to first 500.')
-            queries = list(queries)[:MAX_ENDPOINT_LIMIT]
+                self.logger.debug(f'{name} cache hit')
+            return r
+
+        # single-flight: identical concurrent requests share one response. the request runs in its own task,
+        # every caller awaits it through `shield`, so cancelling one caller does not cancel it for the others
+        key = (name, query_key(variables))
+        if (task := self._inflight.get(key)) is None:
+            task = self._inflight[key] = asyncio.ensure_future(self._request(operation, variables, **kwargs))
+            task.add_done_callback(partial(self._settle, key))
+        return await asyncio.shield(task)
+
+    def _settle(self, key: tuple, task: asyncio.Task):
+        del self._inflight[key]
+        if not task.cancelled():
+            task.exception()  # mark as retrieved, in case every caller was cancelled
+
+    def _template(self, operation: tuple) -> RequestTemplate:
+        keys, qid, name = operation
+        if (t := self._templates.get(qid)) is None:
+            t = self._templates[qid] = RequestTemplate(f'https://twitter.com/i/api/graphql/{qid}/{name}',
+                                                       Operation.default_variables | keys,
+                                                       features=Operation.default_features)
+        return t
 
-        if all(isinstance(q, dict) for q in queries):
-            data = asyncio.run(self._process(operation, list(queries), **kwargs))
-            return [get_json(t, **kwargs) for t in data]
+    def _url(self, operation: tuple, variables: dict) -> str:
+        return self._template(operation).url(variables)
 
-        # queries are of type set | list[int|str], need to convert to list[dict]
-        _queries = [{k: q} for q in queries for k, v in keys.items()]
-        res = asyncio.run(self._process(operation, _queries, **kwargs))
-        return [get_json(t, **kwargs) for t in res]
+    def _batch(self, operation: tuple, ids: list, **kwargs) -> list[list[str]]:
+        """Split ids into batch queries, sized on the full encoded request"""
+        keys, qid, name = operation
+        kwargs = {k: v for k, v in kwargs.items() if k not in {'limit', 'cursor', 'max_query'}}
+        base = len(self._url(operation, self._template(operation).variables(**{k: [] for k in keys}, **kwargs)))
+        return self.batcher.batch(name, ids, base)
 
-    async def _query(self, client: AsyncClient, operation: tuple, **kwargs) -> Response:
+    def _split(self, operation: tuple, r: Page, query: dict) -> list[dict] | None:
+        """Learn from a 431 and split the rejected batch query into smaller ones"""
         keys, qid, name = operation
-        params = {
-            'variables': Operation.default_variables | keys | kwargs,
-            'features': Operation.default_features,
-        }
-        r = await client.get(f'https://twitter.com/i/api/graphql/{qid}/{name}', params=build_params(params))
+        key = next((k for k, t in keys.items() if t is list), None)
+        if key is None or len(ids := query.get(key) or []) < 2:
+            return
+        self.batcher.reject(name, len(str(r.url)))
+        batches = self._batch(operation, ids, **{k: v for k, v in query.items() if k != key})
+        if len(batches) < 2:
+            batches = [ids[:len(ids) // 2], ids[len(ids) // 2:]]
+        if self.debug:
+            self.logger.warning(f'{name} request too large ({len(str(r.url))} chars), '
+                                f'retrying as {len(batches)} batches (limit: {self.batcher.limit(name)})')
+        return [query | {key: batch} for batch in batches]
+
+    async def _fetch(self, operation: tuple, **kwargs) -> Page:
+        """
+        `_query` with retries, see `RetryPolicy`. a 401 is resent on another session if it got a session revoked
+
+        Raises once retries are exhausted, so a failed page is never mistaken for the end of pagination.
+        """
+        name = operation[-1]
+        attempt = 0
+        while True:
+            r = err = None
+            revoked = self.pool.revoked
+            try:
+                r = await self._query(operation, **kwargs)
+                if r.status_code == 401 and self.pool.revoked > revoked:
+                    # a session was removed from the pool, resend on another one. not counted as a retry,
+                    # every resend needs another session to be revoked and the last one never is
+                    if self.debug:
+                        self.logger.warning(f'{YELLOW}{name} 401, resending on another session{RESET}')
+                    self.metrics.retry(name, r.status_code)
+                    continue
+                if not self.retry.retryable(r):
+                    return r
+            except Exception as e:
+                if not self.retry.retryable(e=e):
+                    raise
+                err = e
+            if attempt >= self.retry.retries:
+                raise Exception(f'{name} failed after {attempt} retries: {err or r.status_code}')
+            if r is not None and r.status_code == 429 and self.pool.remaining(name) > 0:
+                t = 0  # other sessions still have budget, `pool.acquire` routes around this one
+            else:
+                t = self.retry.delay(attempt, r)
+            if self.debug:
+                self.logger.warning(f'{YELLOW}{name} {err or r.status_code}, retrying in {t:.2f} seconds{RESET}')
+            self.metrics.retry(name, type(err).__name__ if err else r.status_code)
+            await asyncio.sleep(t)
+            attempt += 1
+
+    async def _request(self, operation: tuple, variables: dict, **kwargs) -> Page:
+        keys, qid, name = operation
+        url = self._url(operation, variables)
+        # route to the session with the most remaining budget for this operation
+        member = await self.pool.acquire(name)
+        start = time.perf_counter()
+        try:
+            r = await member.client.get(url)
+        except Exception as e:
+            self.pool.release(member, name, error=True)
+            self.metrics.error(name, e)
+            raise
+        self.pool.update(member, name, r)
+        r = Page.from_response(r)
+        self.metrics.request(name, r.status_code, time.perf_counter() - start, len(r.content), self.pool.remaining(name))
+        if not member.active and self.debug:
+            self.logger.warning(f'{RED}Session {member} unauthorized, removed from pool{RESET}')
+        if self.cache:
+            self.cache.set(name, variables, r)
         if self.debug:
             log(self.logger, self.debug, r)
-        if self.save:
-            await save_json(r, self.out, name, **kwargs)
+        if self.archive and 'json' in r.headers.get('content-type', ''):
+            await self.archive.write(name, r.content, variables)
         return r
 
     async def _process(self, operation: tuple, queries: list[dict], **kwargs):
-        headers = self.session.headers if self.guest else get_headers(self.session)
-        cookies = self.session.cookies
-        async with AsyncClient(limits=Limits(max_connections=MAX_ENDPOINT_LIMIT), headers=headers, cookies=cookies, timeout=20) as c:
-            tasks = (self._paginate(c, operation, **q, **kwargs) for q in queries)
-            if self.pbar:
-                return await tqdm_asyncio.gather(*tasks, desc=operation[-1])
-            return await asyncio.gather(*tasks)
+        tasks = (self._paginate(operation, **q, **kwargs) for q in queries)
+        desc = operation[-1] if self.pbar else None
+        return await bounded_gather(tasks, self.concurrency, desc=desc, total=len(queries))
 
-    async def _paginate(self, client: AsyncClient, operation: tuple, **kwargs):
-        limit = kwargs.pop('limit', math.inf)
+    async def _paginate(self, operation: tuple, **kwargs):
         need_cursor = 'cursor' in kwargs
+        state = {}
+        res = []
+        try:
+            async for r, commit in self._pages(operation, state, **kwargs):
+                res.append(r)
+                commit and commit()
+        except Exception as e:
+            # keep the pages already fetched, `state['cursor']` is the last good cursor to resume from
+            if self.debug or not self.pool.active:
+                self.logger.error(f'Failed to get pagination data after {len(res)} pages\tcursor: {state.get("cursor")}\n{e}')
+        self.metrics.query(operation[-1], len(res))
+        if need_cursor:
+            return res, state.get('cursor')
+        return res
+
+    async def _pages(self, operation: tuple, state: dict = None, **kwargs) -> AsyncGenerator[tuple[Page, Callable | None], None]:
+        """
+        Yield pages for a single query until pagination is exhausted
+
+        @param operation: operation to query
+        @param state: optional dict, updated with the latest `cursor`
+        @param kwargs: query variables, as well as `limit`, `cursor` and `max_query`
+        @return: async generator of `(page, commit)`
+
+        With checkpoints, only queries that actually paginate (a page returned a cursor) are recorded, so single
+        requests (e.g. `UsersByRestIds`) are never skipped on later runs. `commit` records the page in the checkpoint
+        store (it is None otherwise), the consumer calls it once the page is handled, so pages fetched ahead of the
+        consumer are fetched again after a crash or an early exit.
+        """
+        state = {} if state is None else state
+        limit = kwargs.pop('limit', math.inf)
         cursor = kwargs.pop('cursor', '')
         max_query = kwargs.pop('max_query', 1 << 60)
+        name = operation[-1]
+        pages = 0
         dups = 0
         DUP_LIMIT = 3
+        paginated = False  # whether a cursor was followed, i.e. the query is worth a checkpoint
 
-        res = []
+        # resume from the last committed cursor, unless a cursor is given explicitly
+        if self.checkpoints and not cursor and (cp := self.checkpoints.get(name, kwargs)):
+            if cp['done']:
+                if self.debug:
+                    self.logger.debug(f'{name} {kwargs} already completed, skipping')
+                return
+            cursor, pages = cp['cursor'], cp['pages']
+            paginated = True
+            if self.debug:
+                self.logger.debug(f'{name} {kwargs} resuming after {pages} pages\tcursor: {cursor}')
+
+        state.setdefault('cursor', cursor)
         ids = set()
         while max_query > 0 and (dups < DUP_LIMIT) and not cursor is None:
             prev_len = len(ids)
             if prev_len >= limit:
                 break
-            try:
-                max_query -= 1
-                if cursor: kwargs['cursor'] = cursor
-                r = await self._query(client, operation, **kwargs)
-                data = r.json()
-            except Exception as e:
-                if self.debug:
-                    self.logger.error(f'Failed to get pagination data\n{e}')
+            max_query -= 1
+            if cursor: kwargs['cursor'] = cursor
+            r = await self._fetch(operation, **kwargs)
+            if r.status_code == 431 and (queries := self._split(operation, r, kwargs)):
+                for q in queries:
+                    async for p in self._pages(operation, state, **q):
+                        yield p
                 return
-            cursor = get_cursor(data)
-            ids |= {x for x in find_key(data, 'rest_id') if x[0].isnumeric()}
+            data = r.data
+            found = find_keys(data, ('rest_id', 'entries'))
+            cursor = state['cursor'] = get_cursor(data, found['entries'])
+            ids |= {x for x in found['rest_id'] if x[0].isnumeric()}
 
             if self.debug:
                 self.logger.debug(f'Unique results: {len(ids)}\tcursor: {cursor}')
             if prev_len == len(ids):
                 dups += 1
-            res.append(r)
-        if need_cursor:
-            return res, cursor
-        return res
+            pages += 1
+            paginated = paginated or cursor is not None
+            commit = None
+            if self.checkpoints and paginated:
+                done = cursor is None or dups >= DUP_LIMIT
+                commit = partial(self.checkpoints.commit, name, dict(kwargs), cursor, pages, done=done)
+            yield r, commit
 
     async def _space_listener(self, chat: dict, frequency: int):
         rand_color = lambda: random.choice([RED, GREEN, RESET, BLUE, CYAN, MAGENTA, YELLOW])
@@ -740,13 +1018,13 @@ class Scraper:
         @return: None
         """
 
-        async def get(spaces: list[dict]):
+        async def get():
+            spaces = await self._spaces(rooms=[room])
             client = init_session()
             chats = await self._get_live_chats(client, spaces)
             await asyncio.gather(*(self._space_listener(c, frequency) for c in chats))
 
-        spaces = self.spaces(rooms=[room])
-        asyncio.run(get(spaces))
+        return self._sync(get())
 
     def spaces_live(self, rooms: list[str]):
         """
@@ -821,14 +1099,12 @@ class Scraper:
                     await asyncio.sleep(random.random() + 1.5)
             return {'space': space, 'chunks': sort_chunks(all_chunks)}
 
-        async def process(spaces: list[dict]):
-            limits = Limits(max_connections=100)
-            headers, cookies = self.session.headers, self.session.cookies
-            async with AsyncClient(limits=limits, headers=headers, cookies=cookies, timeout=20) as c:
-                return await asyncio.gather(*(poll_space(c, space) for space in spaces))
+        async def process():
+            spaces = await self._spaces(rooms=rooms)
+            c = self._client()
+            return await asyncio.gather(*(poll_space(c, space) for space in spaces))
 
-        spaces = self.spaces(rooms=rooms)
-        return asyncio.run(process(spaces))
+        return self._sync(process())
 
     def _init_logger(self, **kwargs) -> Logger:
         if kwargs.get('debug'):
@@ -845,6 +1121,101 @@ class Scraper:
 
             return logging.getLogger(logger_name)
 
+    def _sync(self, coro):
+        """
+        Run a coroutine to completion
+
+        Uses an event loop owned by this instance, so that persistent connections are reused across calls.
+        """
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            if self._loop is None or self._loop.is_closed():
+                self._loop = asyncio.new_event_loop()
+            return self._loop.run_until_complete(self._call(coro))
+        # already inside a running loop, e.g. Jupyter (patched by `nest_asyncio`)
+        return asyncio.run(self._call(coro))
+
+    async def _call(self, coro):
+        try:
+            return await coro
+        finally:
+            # no task is left pending on the idle loop, the archive writer restarts on the next call
+            if self.archive:
+                await self.archive.stop()
+
+    def _client(self) -> AsyncClient:
+        """Persistent client of the main session"""
+        return self.pool.members[0].client
+
+    def _media_client(self, limits: dict) -> PersistentClient:
+        if self._media is None:
+            headers = {'user-agent': random.choice(USER_AGENTS)}
+            self._media = PersistentClient(limits=Limits(**limits), headers=headers, http2=True, verify=False,
+                                           timeout=60, follow_redirects=True)
+        return self._media
+
+    async def _aclose(self):
+        if self.archive:
+            await self.archive.aclose()
+        await self.pool.aclose()
+        if self._media:
+            await self._media.aclose()
+
+    def health(self) -> dict:
+        """
+        Circuit breaker state per session and operation
+
+        @return: dict of {session: {operation: {state, error_rate, requests, trips, retry_in}}}
+        """
+        return self.pool.health()
+
+    def close(self):
+        """Close persistent connections, the event loop owned by this instance, the archive and checkpoints"""
+        if self._loop and not self._loop.is_closed():
+            self._loop.run_until_complete(self._aclose())
+            self._loop.close()
+        if self.archive:
+            self.archive.close()
+        if self.checkpoints:
+            self.checkpoints.close()
+        if self.cache:
+            self.cache.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _init_archive(self, **kwargs) -> ArchiveWriter | None:
+        if isinstance(archive := kwargs.get('archive'), ArchiveWriter):
+            return archive
+        if self.save:
+            return ArchiveWriter(self.out / 'raw', segment_size=kwargs.get('segment_size', SEGMENT_SIZE),
+                                 compression=kwargs.get('compression'))
+
+    def _init_cache(self, **kwargs) -> ResponseCache | None:
+        if isinstance(cache := kwargs.get('cache'), ResponseCache):
+            return cache
+        if cache:
+            return ResponseCache()
+
+    def _init_checkpoints(self, **kwargs) -> CheckpointStore | None:
+        if checkpoint := kwargs.get('checkpoint'):
+            return CheckpointStore(self.out / 'checkpoints.db' if checkpoint is True else checkpoint)
+
+    def _init_pool(self, **kwargs) -> SessionPool:
+        # connections are multiplexed over HTTP/2 and kept alive across calls
+        pool = SessionPool(breaker=kwargs.get('breaker'), limits=Limits(max_connections=self.concurrency), http2=True, timeout=20)
+        if self.session:
+            pool.add(self.session, guest=self.guest, limiter=self.rate_limiter)
+        for session in kwargs.get('sessions', []):
+            pool.add(session)
+        if n := kwargs.get('guests'):
+            pool.add_guests(n)
+        return pool
+
     def _validate_session(self, *args, **kwargs):
         email, username, password, session = args
 
@@ -886,3 +1257,33 @@ class Scraper:
         """ Save cookies to file """
         cookies = self.session.cookies
         Path(f'{fname or cookies.get("username")}.cookies').write_bytes(orjson.dumps(dict(cookies)))
+
+
+class AsyncScraper(Scraper):
+    """
+    Scraper with awaitable methods, running on the caller's event loop
+
+    Every public method of `Scraper` returns a coroutine instead of blocking, so many independent
+    jobs can overlap in one process.
+
+    e.g.
+    async with AsyncScraper(cookies='twitter.cookies') as scraper:
+        users, tweets = await asyncio.gather(scraper.users(['foo']), scraper.tweets([123]))
+    """
+
+    def _sync(self, coro):
+        return coro
+
+    async def aclose(self):
+        """Close persistent connections and checkpoints"""
+        await self._aclose()
+        if self.checkpoints:
+            self.checkpoints.close()
+        if self.cache:
+            self.cache.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.aclose()
@@ -11,9 +11,11 @@ from pathlib import Path
 import orjson
 from httpx import AsyncClient, Client
 
+from .archive import ArchiveWriter
 from .constants import *
 from .login import login
-from .util import get_headers, find_key, build_params
+from .metrics import Metrics
+from .util import get_headers, find_key, find_keys, RequestTemplate
 
 reset = '\x1b[0m'
 colors = [f'\x1b[{i}m' for i in range(31, 37)]
@@ -37,6 +39,13 @@ class Search:
     def __init__(self, email: str = None, username: str = None, password: str = None, session: Client = None, **kwargs):
         self.save = kwargs.get('save', True)
         self.debug = kwargs.get('debug', 0)
+        self.compression = kwargs.get('compression')
+        _, qid, name = Operation.SearchTimeline
+        self.template = RequestTemplate(f'https://twitter.com/i/api/graphql/{qid}/{name}',
+                                        features=Operation.default_features,
+                                        fieldToggles={'withArticleRichContentState': False})
+        self.archive = None
+        self.metrics = kwargs.get('metrics') or Metrics()
         self.logger = self._init_logger(**kwargs)
         self.session = self._validate_session(email, username, password, session, **kwargs)
 
@@ -46,8 +55,14 @@ class Search:
         return asyncio.run(self.process(queries, limit, out, **kwargs))
 
     async def process(self, queries: list[dict], limit: int, out: Path, **kwargs) -> list:
-        async with AsyncClient(headers=get_headers(self.session)) as s:
-            return await asyncio.gather(*(self.paginate(s, q, limit, out, **kwargs) for q in queries))
+        # pages are archived to `{out}/SearchTimeline/SearchTimeline-{seq}.jsonl[.zst|.gz]`
+        self.archive = ArchiveWriter(out, compression=self.compression) if self.save else None
+        try:
+            async with AsyncClient(headers=get_headers(self.session)) as s:
+                return await asyncio.gather(*(self.paginate(s, q, limit, out, **kwargs) for q in queries))
+        finally:
+            if self.archive:
+                await self.archive.aclose()
 
     async def paginate(self, client: AsyncClient, query: dict, limit: int, out: Path, **kwargs) -> list[dict]:
         params = {
@@ -57,39 +72,48 @@ class Search:
                 'rawQuery': query['query'],
                 'product': query['category']
             },
-            'features': Operation.default_features,
-            'fieldToggles': {'withArticleRichContentState': False},
         }
 
         res = []
         cursor = ''
         total = set()
+        pages = 0
         while True:
             if cursor:
                 params['variables']['cursor'] = cursor
             data, entries, cursor = await self.backoff(lambda: self.get(client, params), **kwargs)
+            pages += 1
             res.extend(entries)
             if len(entries) <= 2 or len(total) >= limit:  # just cursors
                 self.debug and self.logger.debug(
                     f'[{GREEN}success{RESET}] Returned {len(total)} search results for {query["query"]}')
+                self.metrics.query(Operation.SearchTimeline[-1], pages)
                 return res
             total |= set(find_key(entries, 'entryId'))
             self.debug and self.logger.debug(f'{query["query"]}')
-            self.save and (out / f'{time.time_ns()}.json').write_bytes(orjson.dumps(entries))
+            self.archive and await self.archive.write(Operation.SearchTimeline[-1], orjson.dumps(entries), query)
 
     async def get(self, client: AsyncClient, params: dict) -> tuple:
-        _, qid, name = Operation.SearchTimeline
-        r = await client.get(f'https://twitter.com/i/api/graphql/{qid}/{name}', params=build_params(params))
+        # features and fieldToggles are pre-encoded in `self.template`
+        name = Operation.SearchTimeline[-1]
+        start = time.perf_counter()
+        try:
+            r = await client.get(self.template.url(params['variables']))
+        except Exception as e:
+            self.metrics.error(name, e)
+            raise
+        self.metrics.response(name, r, time.perf_counter() - start)
         data = r.json()
-        cursor = self.get_cursor(data)
-        entries = [y for x in find_key(data, 'entries') for y in x if re.search(r'^(tweet|user)-', y['entryId'])]
+        found = find_keys(data, ('entries', 'content', 'entryId'))
+        cursor = self.get_cursor(data, found['content'])
+        entries = [y for x in found['entries'] for y in x if re.search(r'^(tweet|user)-', y['entryId'])]
         # add on query info
         for e in entries:
             e['query'] = params['variables']['rawQuery']
-        return data, entries, cursor
+        return data, entries, cursor, found['entryId']
 
-    def get_cursor(self, data: list[dict]):
-        for e in find_key(data, 'content'):
+    def get_cursor(self, data: list[dict], contents: list = None):
+        for e in find_key(data, 'content') if contents is None else contents:
             if e.get('cursorType') == 'Bottom':
                 return e['value']
 
@@ -97,14 +121,13 @@ class Search:
         retries = kwargs.get('retries', 3)
         for i in range(retries + 1):
             try:
-                data, entries, cursor = await fn()
+                data, entries, cursor, ids = await fn()
                 if errors := data.get('errors'):
                     for e in errors:
                         if self.debug:
                             self.logger.warning(f'{YELLOW}{e.get("message")}{RESET}')
                         return [], [], ''
-                ids = set(find_key(data, 'entryId'))
-                if len(ids) >= 2:
+                if len(set(ids)) >= 2:
                     return data, entries, cursor
             except Exception as e:
                 if i == retries:
@@ -114,6 +137,7 @@ class Search:
                 t = 2 ** i + random.random()
                 if self.debug:
                     self.logger.debug(f'Retrying in {f"{t:.2f}"} seconds\t\t{e}')
+                self.metrics.retry(Operation.SearchTimeline[-1], type(e).__name__)
                 await asyncio.sleep(t)
 
     def _init_logger(self, **kwargs) -> Logger: